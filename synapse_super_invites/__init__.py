@@ -1,20 +1,33 @@
 import os
 from typing import Any, Dict
 
-from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 from synapse.config import ConfigError
 from synapse.module_api import ModuleApi
 from twisted.web.static import File
 
 from .config import SynapseSuperInvitesConfig, ShareLinkGeneratorConfig,  run_alembic
+from .database import (
+    AnyDatabase,
+    AsyncDatabase,
+    Database,
+    create_async_db_engine,
+    create_db_engine,
+)
+from .jobs import RedeemJobs
+from .profiles import ProfileCache
+from .registration_tokens import RegistrationTokens
 from .resource import (
+    BulkTokensResource,
+    RedeemJobsResource,
     RedeemResource,
     TokenInfoResource,
     TokensResource,
     WebAccessResource,
     ShareLink,
 )
+from .storage import create_share_storage
+from .token_cache import TokenCache
 
 __version__ = "0.8.4"
 
@@ -24,25 +37,71 @@ PKG_DIR = os.path.dirname(os.path.realpath(__file__))
 class SynapseSuperInvites:
     def __init__(self, config: SynapseSuperInvitesConfig, api: ModuleApi):
         # Keep a reference to the config and Module API
-        engine = create_engine(config.sql_url)
-        run_alembic(engine)
-        self._sessions = sessionmaker(engine)
+        # FIXME: it'd be great if we didn't have to resort to using internal args...
+        reactor = api._hs.get_reactor()
+        self._db: AnyDatabase
+        if config.sql_async:
+            async_db = AsyncDatabase(reactor, create_async_db_engine(config))
+            async_db.migrate()
+            self._db = async_db
+        else:
+            engine = create_db_engine(config)
+            run_alembic(engine)
+            self._db = Database(
+                reactor, sessionmaker(engine), config.db_thread_pool_size
+            )
         self._api = api
         self._config = config
+        self._redeem_jobs = RedeemJobs(config, api, self._db)
+        self._profiles = ProfileCache(config, api)
+        self._tokens = TokenCache(api, self._db)
+        self._registration_tokens = RegistrationTokens(config, api)
         self.setup()
 
     def setup(self) -> None:
+        self._api.register_third_party_rules_callbacks(
+            on_profile_update=self._profiles.on_profile_update,
+        )
         self._api.register_web_resource(
             "/_synapse/client/super_invites/info",
-            TokenInfoResource(self._config, self._api, self._sessions),
+            TokenInfoResource(
+                self._config, self._api, self._db, self._tokens, self._profiles
+            ),
         )
         self._api.register_web_resource(
             "/_synapse/client/super_invites/tokens",
-            TokensResource(self._config, self._api, self._sessions),
+            TokensResource(
+                self._config,
+                self._api,
+                self._db,
+                self._tokens,
+                self._registration_tokens,
+            ),
+        )
+        self._api.register_web_resource(
+            "/_synapse/client/super_invites/bulk_tokens",
+            BulkTokensResource(
+                self._config,
+                self._api,
+                self._db,
+                self._tokens,
+                self._registration_tokens,
+            ),
         )
         self._api.register_web_resource(
             "/_synapse/client/super_invites/redeem",
-            RedeemResource(self._config, self._api, self._sessions),
+            RedeemResource(
+                self._config, self._api, self._db, self._tokens, self._redeem_jobs
+            ),
+        )
+        self._api.register_web_resource(
+            "/_synapse/client/super_invites/redeem_jobs",
+            RedeemJobsResource(self._config, self._api, self._db, self._tokens),
+        )
+        self._api.looping_background_call(
+            self._redeem_jobs.process_pending,
+            self._config.redeem_jobs_interval_ms,
+            desc="super_invites_redeem_jobs",
         )
 
         if self._config.enable_web:
@@ -56,10 +115,15 @@ class SynapseSuperInvites:
             )
 
         if self._config.share_link_generator is not None:
+            # handles everything below it: `/`, `/batch` and the pages
             self._api.register_web_resource(
-                "/_synapse/client/share_link/",
-                ShareLink(self._config.share_link_generator,
-                          self._api),
+                "/_synapse/client/share_link",
+                ShareLink(
+                    self._config.share_link_generator,
+                    self._api,
+                    self._profiles,
+                    create_share_storage(self._config.share_link_generator, self._db),
+                ),
             )
 
     @staticmethod
@@ -69,7 +133,7 @@ class SynapseSuperInvites:
             try:
                 config['share_link_generator'] = ShareLinkGeneratorConfig(
                     **share_link_cfg)
-            except TypeError as e:
+            except (TypeError, ValueError) as e:
                 raise ConfigError(str(e))
 
         try:
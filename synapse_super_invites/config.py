@@ -3,26 +3,104 @@ import os
 import alembic
 import attr
 from alembic.config import Config
-from sqlalchemy import Engine
+from sqlalchemy import Connection, Engine
+from sqlalchemy.ext.asyncio import AsyncEngine
 
 PKG_DIR = os.path.dirname(os.path.realpath(__file__))
 
 
-def run_alembic(engine: Engine) -> None:
+def _upgrade(connection: Connection) -> None:
     alembic_cfg = Config(os.path.join(PKG_DIR, "alembic.ini"))
     alembic_cfg.set_main_option(
         "script_location", os.path.join(PKG_DIR, "migration"))
+    alembic_cfg.attributes["connection"] = connection
+    alembic.command.upgrade(alembic_cfg, "head")
+
 
+def run_alembic(engine: Engine) -> None:
     with engine.begin() as connection:
-        alembic_cfg.attributes["connection"] = connection
-        alembic.command.upgrade(alembic_cfg, "head")
+        _upgrade(connection)
+
+
+async def run_alembic_async(engine: AsyncEngine) -> None:
+    async with engine.begin() as connection:
+        await connection.run_sync(_upgrade)
 
 
 @attr.define
 class ShareLinkGeneratorConfig:
     url_prefix: str
-    target_path: str
+    # the directory for `storage: file`
+    target_path: str | None = attr.field(default=None)
     template_path: str | None = attr.field(default=None)
+    # where to keep the compiled templates across restarts
+    template_cache_dir: str | None = attr.field(default=None)
+    # look for changed templates on every share, for developing them
+    auto_reload_templates: bool = attr.field(default=False)
+    # threads generating the share links, keeping them off the reactor
+    worker_threads: int = attr.field(default=4)
+    # pages remembered as generated, so sharing them again is a no-op
+    known_pages: int = attr.field(default=10000)
+    # when set, pages are queued and written in the background at this
+    # interval, each file is still fsynced on its own
+    write_behind_ms: int | None = attr.field(default=None)
+    # serve the pages and images from synapse, rather than a separate web server
+    serve: bool = attr.field(default=False)
+    serve_max_age: int = attr.field(default=3600)
+    # only store the link on share, render it when first asked for. Needs `serve`
+    lazy: bool = attr.field(default=False)
+    # memory for the lazily rendered pages and images
+    lazy_cache_bytes: int = attr.field(default=64 * 1024 * 1024)
+    # where the pages are kept: `file` in `target_path`, `sql` in the
+    # module's database or `s3` in a bucket
+    storage: str = attr.field(
+        default="file", validator=attr.validators.in_(["file", "sql", "s3"])
+    )
+    # `file` only: spread the files over this many levels of sub directories,
+    # named after the first characters of the hash
+    shard_depth: int = attr.field(default=0, validator=attr.validators.in_([0, 1, 2]))
+    # `file` only: remove the files of links not used for this long, and of
+    # the least recently used ones beyond this total size
+    gc_max_age_ms: int | None = attr.field(default=None)
+    gc_max_bytes: int | None = attr.field(default=None)
+    gc_interval_ms: int = attr.field(default=60 * 60 * 1000)
+    s3_bucket: str | None = attr.field(default=None)
+    s3_prefix: str = attr.field(default="")
+    # e.g. of a MinIO server, AWS by default
+    s3_endpoint_url: str | None = attr.field(default=None)
+    s3_region: str | None = attr.field(default=None)
+    # boto3's usual environment and config files are used when unset
+    s3_access_key_id: str | None = attr.field(default=None)
+    s3_secret_access_key: str | None = attr.field(default=None)
+    # memory for files read back from `sql` or `s3`, and for how long they are
+    # used before checking for changes made by other workers
+    storage_cache_bytes: int = attr.field(default=32 * 1024 * 1024)
+    storage_cache_ttl_ms: int = attr.field(default=60 * 1000)
+    # social preview images next to each page
+    previews: bool = attr.field(default=False)
+    preview_format: str = attr.field(
+        default="png", validator=attr.validators.in_(["png", "webp"])
+    )
+    preview_font_path: str | None = attr.field(default=None)
+    # a color emoji font, e.g. NotoColorEmoji.ttf, to draw the icon with
+    preview_emoji_font_path: str | None = attr.field(default=None)
+
+    def __attrs_post_init__(self) -> None:
+        if self.lazy and not self.serve:
+            raise ValueError("share_link_generator.lazy needs serve to be enabled")
+        if self.storage == "file" and self.target_path is None:
+            raise ValueError("share_link_generator.target_path is missing")
+        if self.storage == "sql" and not self.serve:
+            # nothing else can get at them
+            raise ValueError(
+                "share_link_generator.storage sql needs serve to be enabled"
+            )
+        if self.storage != "file" and (
+            self.gc_max_age_ms is not None or self.gc_max_bytes is not None
+        ):
+            raise ValueError("share_link_generator.gc_* needs storage file")
+        if self.storage == "s3" and self.s3_bucket is None:
+            raise ValueError("share_link_generator.s3_bucket is missing")
 
 
 @attr.define
@@ -30,5 +108,27 @@ class SynapseSuperInvitesConfig:
     sql_url: str
     generate_registration_token: bool = attr.field(default=False)
     enable_web: bool = attr.field(default=False)
+    db_thread_pool_size: int = attr.field(default=10)
+    # how many rooms to join at the same time when redeeming
+    redeem_concurrency: int = attr.field(default=5)
+    # how often to look for queued background redeem jobs
+    redeem_jobs_interval_ms: int = attr.field(default=1000)
+    # how long a running redeem job may go without progress before it is
+    # taken to be abandoned and queued again
+    redeem_jobs_lease_ms: int = attr.field(default=5 * 60 * 1000)
+    # inviter profiles shown on the token info and share links
+    profile_cache_size: int = attr.field(default=1000)
+    profile_cache_ttl_ms: int = attr.field(default=5 * 60 * 1000)
+    # use sqlalchemy's asyncio extension, needs an async driver in `sql_url`
+    # like `sqlite+aiosqlite://` or `postgresql+asyncpg://`
+    sql_async: bool = attr.field(default=False)
+    # connection pool tuning, unset values keep sqlalchemy's defaults
+    pool_size: int | None = attr.field(default=None)
+    max_overflow: int | None = attr.field(default=None)
+    pool_timeout: float | None = attr.field(default=None)
+    pool_recycle: int | None = attr.field(default=None)
+    pool_pre_ping: bool = attr.field(default=False)
+    # in milliseconds, postgres only
+    statement_timeout: int | None = attr.field(default=None)
     share_link_generator: ShareLinkGeneratorConfig | None = attr.field(
         default=None)
@@ -0,0 +1,221 @@
+import asyncio
+import logging
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Coroutine, Dict, TypeVar, Union
+
+from prometheus_client import Histogram
+from sqlalchemy import URL, Engine, Insert, Table, create_engine, make_url
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncEngine, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import StaticPool
+from synapse.logging.context import defer_to_threadpool, make_deferred_yieldable
+from synapse.types import ISynapseReactor
+from twisted.internet.asyncioreactor import AsyncioSelectorReactor
+from twisted.internet.defer import Deferred
+from twisted.python.failure import Failure
+from twisted.python.threadpool import ThreadPool
+
+from .config import SynapseSuperInvitesConfig, run_alembic_async
+
+logger = logging.getLogger(__name__)
+
+R = TypeVar("R")
+
+checkout_wait = Histogram(
+    "synapse_super_invites_db_checkout_wait_seconds",
+    "Time spent waiting for a connection from the super invites db pool",
+)
+
+
+def _engine_args(config: SynapseSuperInvitesConfig, url: URL) -> Dict[str, Any]:
+    if url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:"):
+        # an in-memory database only exists on the connection that created it,
+        # so all threads have to share that very connection.
+        return {
+            "poolclass": StaticPool,
+            "connect_args": {"check_same_thread": False},
+        }
+
+    args: Dict[str, Any] = {"pool_pre_ping": config.pool_pre_ping}
+    for key in ("pool_size", "max_overflow", "pool_timeout", "pool_recycle"):
+        value = getattr(config, key)
+        if value is not None:
+            args[key] = value
+
+    if config.statement_timeout is not None:
+        if url.get_backend_name() != "postgresql":
+            logger.warning(
+                "statement_timeout is only supported on postgres, ignoring it"
+            )
+        elif url.get_driver_name() == "asyncpg":
+            args["connect_args"] = {
+                "server_settings": {"statement_timeout": str(config.statement_timeout)}
+            }
+        else:
+            args["connect_args"] = {
+                "options": "-c statement_timeout={t}".format(t=config.statement_timeout)
+            }
+    return args
+
+
+def insert_or_ignore(session: Session, table: Table) -> Insert | None:
+    """An INSERT that skips the rows conflicting with existing ones, None if
+    the database doesn't support that."""
+    dialect = session.get_bind().dialect.name
+    if dialect == "postgresql":
+        return postgresql.insert(table).on_conflict_do_nothing()
+    if dialect == "sqlite":
+        return sqlite.insert(table).on_conflict_do_nothing()
+    return None
+
+
+def create_db_engine(config: SynapseSuperInvitesConfig) -> Engine:
+    url = make_url(config.sql_url)
+    return create_engine(url, **_engine_args(config, url))
+
+
+def create_async_db_engine(config: SynapseSuperInvitesConfig) -> AsyncEngine:
+    url = make_url(config.sql_url)
+    return create_async_engine(url, **_engine_args(config, url))
+
+
+class Database:
+    """Runs blocking SQLAlchemy session work on a dedicated, bounded thread pool
+    rather than on the reactor thread."""
+
+    def __init__(
+        self,
+        reactor: ISynapseReactor,
+        sessions: sessionmaker,  # type: ignore[type-arg]
+        threads: int,
+    ):
+        self._reactor = reactor
+        self._sessions = sessions
+        self._threadpool = ThreadPool(
+            minthreads=1, maxthreads=threads, name="super_invites_db"
+        )
+        self._started = False
+        # the interface is declared without `self`, only the zope plugin
+        # knows to skip it
+        reactor.addSystemEventTrigger(
+            "during", "shutdown", self._stop  # type: ignore[arg-type]
+        )
+
+    def _stop(self) -> None:
+        if self._started:
+            self._threadpool.stop()
+            self._started = False
+
+    def _in_transaction(self, func: Callable[..., R], *args: Any) -> R:
+        with self._sessions.begin() as session:
+            start = time.monotonic()
+            session.connection()
+            checkout_wait.observe(time.monotonic() - start)
+            return func(session, *args)
+
+    async def run(self, func: Callable[..., R], *args: Any) -> R:
+        """Call `func(session, *args)` within a single transaction on the
+        database thread pool and return its result.
+
+        The session is closed once `func` returns, so `func` must only hand
+        back plain data, never ORM instances.
+        """
+        if not self._started:
+            self._threadpool.start()
+            self._started = True
+        return await defer_to_threadpool(
+            self._reactor, self._threadpool, self._in_transaction, func, *args
+        )
+
+    def run_blocking(self, func: Callable[..., R], *args: Any) -> R:
+        """Like `run`, but on the calling thread, for callers that already
+        are off the reactor."""
+        return self._in_transaction(func, *args)
+
+
+class AsyncDatabase:
+    """Runs session work through SQLAlchemy's asyncio extension, so in-flight
+    queries wait on the network rather than each holding a thread.
+
+    When synapse runs on twisted's asyncio reactor, we share its event loop.
+    Otherwise a single private event loop thread serves all queries.
+    """
+
+    def __init__(self, reactor: ISynapseReactor, engine: AsyncEngine):
+        self._reactor = reactor
+        self._engine = engine
+        self._sessions = async_sessionmaker(engine)
+        self._thread: threading.Thread | None = None
+        if isinstance(reactor, AsyncioSelectorReactor):
+            self._loop = reactor._asyncioEventloop
+        else:
+            self._loop = asyncio.new_event_loop()
+            self._thread = threading.Thread(
+                target=self._loop.run_forever, name="super_invites_db", daemon=True
+            )
+            self._thread.start()
+        reactor.addSystemEventTrigger(
+            "during", "shutdown", self._stop  # type: ignore[arg-type]
+        )
+
+    def _stop(self) -> None:
+        if self._thread is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+            self._thread = None
+
+    def migrate(self) -> None:
+        """Run the alembic migrations, blocking until they are done. Only to
+        be used during start up."""
+        if self._thread is None:
+            # the reactor, and with it the loop, isn't running yet
+            self._loop.run_until_complete(run_alembic_async(self._engine))
+        else:
+            asyncio.run_coroutine_threadsafe(
+                run_alembic_async(self._engine), self._loop
+            ).result()
+
+    async def _in_transaction(self, func: Callable[..., R], *args: Any) -> R:
+        async with self._sessions.begin() as session:
+            start = time.monotonic()
+            await session.connection()
+            checkout_wait.observe(time.monotonic() - start)
+            return await session.run_sync(func, *args)
+
+    def _schedule(self, coro: Coroutine[Any, Any, R]) -> "Deferred[R]":
+        if self._thread is None:
+            return Deferred.fromFuture(asyncio.ensure_future(coro, loop=self._loop))
+
+        d: "Deferred[R]" = Deferred()
+
+        def _fire(future: "Future[R]") -> None:
+            error = future.exception()
+            if error is not None:
+                d.errback(Failure(error))  # type: ignore[no-untyped-call]
+            else:
+                d.callback(future.result())
+
+        asyncio.run_coroutine_threadsafe(coro, self._loop).add_done_callback(
+            lambda future: self._reactor.callFromThread(_fire, future)
+        )
+        return d
+
+    async def run(self, func: Callable[..., R], *args: Any) -> R:
+        """Call `func(session, *args)` within a single transaction and return
+        its result. See `Database.run`."""
+        return await make_deferred_yieldable(
+            self._schedule(self._in_transaction(func, *args))
+        )
+
+    def run_blocking(self, func: Callable[..., R], *args: Any) -> R:
+        """Like `run`, blocking the calling thread until it is done. Must not
+        be called from the reactor."""
+        return asyncio.run_coroutine_threadsafe(
+            self._in_transaction(func, *args), self._loop
+        ).result()
+
+
+AnyDatabase = Union[Database, AsyncDatabase]
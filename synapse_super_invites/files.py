@@ -0,0 +1,127 @@
+import os
+import tempfile
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+
+
+def _umask() -> int:
+    # it can only be read by setting it
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
+
+# what `open` would create files with, mkstemp only allows us to read them
+NEW_FILE_MODE = 0o666 & ~_umask()
+
+
+def _mode(path: str) -> int:
+    try:
+        # keep the mode of the file we replace
+        return os.stat(path).st_mode & 0o7777
+    except FileNotFoundError:
+        return NEW_FILE_MODE
+
+
+def _write_temp(path: str, data: bytes, sync: bool) -> str:
+    directory, name = os.path.split(path)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".{n}.".format(n=name))
+    try:
+        with os.fdopen(fd, "wb") as f:
+            # e.g. a web server running as another user still has to read it
+            os.fchmod(f.fileno(), _mode(path))
+            f.write(data)
+            if sync:
+                f.flush()
+                os.fsync(f.fileno())
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return tmp_path
+
+
+def _fsync(path: str) -> None:
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _fsync_dir(directory: str) -> None:
+    # makes the renames themselves durable
+    _fsync(directory)
+
+
+def write_atomic(path: str, data: bytes) -> None:
+    """Write `data` to `path` so that readers only ever see the old or the
+    complete new file, never a partial one."""
+    tmp_path = _write_temp(path, data, sync=True)
+    try:
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    _fsync_dir(os.path.dirname(path))
+
+
+def write_atomic_batch(files: Dict[str, bytes]) -> None:
+    """Write all `files`, path to data, atomically like `write_atomic` does.
+
+    Every file is still fsynced on its own, only the fsync of each
+    directory is shared by all files of the batch in it.
+    """
+    written: List[Tuple[str, str]] = []
+    try:
+        for path, data in files.items():
+            written.append((_write_temp(path, data, sync=False), path))
+        for tmp_path, _path in written:
+            _fsync(tmp_path)
+        while written:
+            tmp_path, path = written[0]
+            os.replace(tmp_path, path)
+            written.pop(0)
+    finally:
+        for tmp_path, _path in written:
+            os.unlink(tmp_path)
+
+    for directory in {os.path.dirname(path) for path in files}:
+        _fsync_dir(directory)
+
+
+class BatchedWriter:
+    """Write-behind queue for many small files.
+
+    Files are only written on `flush`, all of them in one call of `write`.
+    Adding the same name again before a flush replaces the queued content,
+    so a file changed repeatedly is only written once. This keeps the
+    writes out of the requests, it doesn't save the fsync of each file.
+    """
+
+    def __init__(self, write: Callable[[Dict[str, bytes]], None]) -> None:
+        self._write = write
+        self._lock = threading.Lock()
+        self._pending: Dict[str, bytes] = {}
+
+    def add(self, name: str, data: bytes) -> None:
+        with self._lock:
+            self._pending[name] = data
+
+    def get(self, name: str) -> Optional[bytes]:
+        """The queued content of `name`, if it hasn't been written yet."""
+        with self._lock:
+            return self._pending.get(name)
+
+    def flush(self) -> None:
+        with self._lock:
+            batch, self._pending = self._pending, {}
+        if not batch:
+            return
+        try:
+            self._write(batch)
+        except BaseException:
+            # try again with the next flush, unless replaced in the meantime
+            with self._lock:
+                for name, data in batch.items():
+                    self._pending.setdefault(name, data)
+            raise
@@ -0,0 +1,267 @@
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Any, Collection, Dict, List, Optional, Tuple, cast
+
+from sqlalchemy import CursorResult, Table, delete, insert, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from synapse.logging.context import make_deferred_yieldable, run_in_background
+from synapse.module_api import ModuleApi
+from synapse.util.async_helpers import concurrently_execute
+
+from .config import SynapseSuperInvitesConfig
+from .database import AnyDatabase, insert_or_ignore
+from .membership import add_to_room, create_dm
+from .model import (
+    JOB_DONE,
+    JOB_FAILED,
+    JOB_PENDING,
+    JOB_RUNNING,
+    ROOM_FAILED,
+    ROOM_JOINED,
+    ROOM_PENDING,
+    Accepted,
+    RedeemJob,
+    RedeemJobRoom,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def reserve_redemption(
+    session: Session, token_id: str, user_id: str, errors: str | None = None
+) -> bool:
+    """Record that the user redeemed the token, unless they already have.
+
+    A single insert guarded by `uq_accepted_user_token_id`, so of any number
+    of concurrent redeems exactly one gets True.
+    """
+    values = {"token_id": token_id, "user": user_id, "errors": errors}
+    statement = insert_or_ignore(session, cast(Table, Accepted.__table__))
+    if statement is not None:
+        result = cast(CursorResult[Any], session.execute(statement.values(**values)))
+        return result.rowcount == 1
+
+    try:
+        with session.begin_nested():
+            session.execute(insert(Accepted).values(**values))
+    except IntegrityError:
+        return False
+    return True
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _requeue_stale(session: Session, lease_ms: int) -> None:
+    # a running job that hasn't made progress within its lease went down with
+    # whoever ran it, e.g. a worker that crashed or was restarted. Rooms
+    # already joined keep their status, so only the remainder is retried.
+    session.execute(
+        update(RedeemJob)
+        .where(
+            RedeemJob.status == JOB_RUNNING,
+            RedeemJob.updated_at < _now() - timedelta(milliseconds=lease_ms),
+        )
+        .values(status=JOB_PENDING)
+    )
+
+
+def _pending_jobs(session: Session) -> List[str]:
+    return list(
+        session.scalars(
+            select(RedeemJob.id)
+            .where(RedeemJob.status == JOB_PENDING)
+            .order_by(RedeemJob.created_at)
+        )
+    )
+
+
+def claim_job(
+    session: Session, job_id: str, statuses: Collection[str] = (JOB_PENDING,)
+) -> Optional[Dict[str, Any]]:
+    """Mark the job as running if it has one of the `statuses`, and return
+    what `RedeemJobs.run` needs to know about it. None if it hasn't."""
+    claimed = cast(
+        CursorResult[Any],
+        session.execute(
+            update(RedeemJob)
+            .where(RedeemJob.id == job_id, RedeemJob.status.in_(statuses))
+            .values(status=JOB_RUNNING, updated_at=_now())
+        ),
+    )
+    if claimed.rowcount != 1:
+        # someone else got to it first
+        return None
+
+    return job_details(session.get_one(RedeemJob, job_id))
+
+
+def job_details(job: RedeemJob) -> Dict[str, Any]:
+    return {
+        "id": job.id,
+        "user": job.user,
+        "owner": job.token.owner,
+        "create_dm": job.create_dm,
+        "dm_room_id": job.dm_room_id,
+        "rooms": [room.room for room in job.rooms if room.status == ROOM_PENDING],
+    }
+
+
+def _update_room(
+    session: Session, job_id: str, room_id: str, status: str, error: Optional[str]
+) -> None:
+    session.execute(
+        update(RedeemJobRoom)
+        .where(RedeemJobRoom.job_id == job_id, RedeemJobRoom.room == room_id)
+        .values(status=status, error=error)
+    )
+    # renews the lease on the job
+    session.execute(
+        update(RedeemJob).where(RedeemJob.id == job_id).values(updated_at=_now())
+    )
+
+
+def _set_dm_room(session: Session, job_id: str, dm_room_id: str) -> None:
+    session.execute(
+        update(RedeemJob)
+        .where(RedeemJob.id == job_id)
+        .values(dm_room_id=dm_room_id, updated_at=_now())
+    )
+
+
+def fail_job(session: Session, job_id: str, error: str) -> None:
+    job = session.get_one(RedeemJob, job_id)
+    job.status = JOB_FAILED
+    job.error = error[:1024]
+    # give up the claim on the token, so it can be redeemed again
+    session.execute(
+        delete(Accepted).where(
+            Accepted.user == job.user, Accepted.token_id == job.token_id
+        )
+    )
+
+
+def joined_rooms(job: RedeemJob) -> List[str]:
+    return [room.room for room in job.rooms if room.status == ROOM_JOINED]
+
+
+def _finish_job(session: Session, job_id: str, dm_room_id: Optional[str]) -> List[str]:
+    job = session.get_one(RedeemJob, job_id)
+    job.status = JOB_DONE
+    if dm_room_id is not None:
+        job.dm_room_id = dm_room_id
+
+    errors = [
+        "{room_id} skipped: '{error}'".format(room_id=room.room, error=room.error)
+        for room in job.rooms
+        if room.status == ROOM_FAILED
+    ]
+    error_msg = None
+    if len(errors) > 0:
+        error_msg = "\n".join(errors)[:1024]
+
+    # keep the accepted record, it may have been reserved at the start
+    if not reserve_redemption(session, job.token_id, job.user, error_msg) and (
+        error_msg is not None
+    ):
+        session.execute(
+            update(Accepted)
+            .where(Accepted.user == job.user, Accepted.token_id == job.token_id)
+            .values(errors=error_msg)
+        )
+    session.flush()
+    return joined_rooms(job)
+
+
+class RedeemJobs:
+    """Works through the redeem jobs queued by `POST /redeem?background=true`.
+
+    Direct redeems are jobs too, just run right away by the request. Jobs live
+    in the database, so they survive a restart: whoever runs a job renews its
+    lease with every room done, and a running job whose lease has expired
+    (`redeem_jobs_lease_ms`) is put back into the queue. Only its rooms not
+    yet joined are attempted again.
+    """
+
+    def __init__(
+        self, config: SynapseSuperInvitesConfig, api: ModuleApi, db: AnyDatabase
+    ):
+        self.config = config
+        self.api = api
+        self.db = db
+        self._processing = False
+
+    async def process_pending(self) -> None:
+        if self._processing:
+            # the last round is still going
+            return
+
+        self._processing = True
+        try:
+            await self.db.run(_requeue_stale, self.config.redeem_jobs_lease_ms)
+
+            for job_id in await self.db.run(_pending_jobs):
+                job = await self.db.run(claim_job, job_id)
+                if job is None:
+                    continue
+                try:
+                    await self.run(job)
+                except Exception as e:
+                    logger.exception("Redeem job {job} failed".format(job=job_id))
+                    await self.db.run(fail_job, job_id, str(e))
+        finally:
+            self._processing = False
+
+    async def run(self, job: Dict[str, Any]) -> Tuple[List[str], Optional[str]]:
+        """Redeem a claimed job: join the rooms not joined yet and create the
+        DM, unless it exists already. Returns all rooms joined by the job and
+        the DM."""
+        job_id = job["id"]
+        user_id = job["user"]
+        owner = job["owner"]
+
+        async def _add_to_room(room_id: str) -> None:
+            status = ROOM_JOINED
+            error = None
+            try:
+                await add_to_room(self.api, owner, user_id, room_id)
+            except Exception as e:
+                status = ROOM_FAILED
+                error = str(e)[:1024]
+                logger.warning(
+                    "Skipping super invite job {job}: Failed to add {user_id} to {room_id}: {error}".format(
+                        job=job_id,
+                        user_id=user_id,
+                        room_id=room_id,
+                        error=e,
+                    )
+                )
+            # progress is stored per room, so it can be polled and resumed
+            await self.db.run(_update_room, job_id, room_id, status, error)
+
+        # the DM doesn't depend on any of the rooms, start it right away
+        dm_d = None
+        if job["create_dm"] and job["dm_room_id"] is None:
+            dm_d = run_in_background(self._create_dm, job_id, user_id, owner)
+
+        dm_room_id = job["dm_room_id"]
+        try:
+            await concurrently_execute(
+                _add_to_room, job["rooms"], self.config.redeem_concurrency
+            )
+        finally:
+            if dm_d is not None:
+                # also when the rooms failed, so the DM is settled before the
+                # job is marked as failed
+                dm_room_id = await make_deferred_yieldable(dm_d)
+
+        joined = await self.db.run(_finish_job, job_id, dm_room_id)
+        return joined, dm_room_id
+
+    async def _create_dm(self, job_id: str, user_id: str, owner: str) -> str:
+        dm_room_id = await create_dm(self.api, user_id, owner)
+        # so resuming the job doesn't create another one
+        await self.db.run(_set_dm_room, job_id, dm_room_id)
+        return dm_room_id
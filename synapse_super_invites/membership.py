@@ -0,0 +1,41 @@
+from synapse.module_api import ModuleApi
+
+
+async def add_to_room(api: ModuleApi, owner: str, user_id: str, room_id: str) -> None:
+    # invited by the owner of the token, then joining ourselves
+    await api.update_room_membership(
+        sender=owner,
+        target=user_id,
+        room_id=room_id,
+        new_membership="invite",
+    )
+
+    await api.update_room_membership(
+        sender=user_id,
+        target=user_id,
+        room_id=room_id,
+        new_membership="join",
+    )
+
+
+async def create_dm(api: ModuleApi, user_id: str, owner: str) -> str:
+    dm_data = await api.create_room(
+        user_id,
+        config={
+            "preset": "trusted_private_chat",
+            "invite": [owner],
+            "is_direct": True,
+            "initial_state": [
+                {  # Encryption enabled
+                    "type": "m.room.encryption",
+                    "state_key": "",
+                    "content": {
+                        "algorithm": "m.megolm.v1.aes-sha2",
+                        "rotation_period_ms": 604800000,
+                        "rotation_period_msgs": 100,
+                    },
+                }
+            ],
+        },
+    )
+    return dm_data[0]
@@ -0,0 +1,58 @@
+"""Add indexes for the token and acceptance lookups
+
+Revision ID: 3f1c7a9d2b64
+Revises: 8c8c90d89eac
+Create Date: 2026-10-18 14:20:31.118204
+
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "3f1c7a9d2b64"
+down_revision: Union[str, None] = "8c8c90d89eac"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index(
+        "ix_tokens_owner_deleted_at", "tokens", ["owner", "deleted_at"], unique=False
+    )
+    op.create_index(
+        "ix_tokens_owner_active",
+        "tokens",
+        ["owner", "created_at", "token"],
+        unique=False,
+        postgresql_where=sa.text("deleted_at IS NULL"),
+        sqlite_where=sa.text("deleted_at IS NULL"),
+    )
+    op.create_index("ix_accepted_token_id", "accepted", ["token_id"], unique=False)
+
+    # concurrent redeems may have left duplicates behind, keep the first one
+    accepted = sa.table(
+        "accepted", sa.column("id"), sa.column("user"), sa.column("token_id")
+    )
+    op.execute(
+        accepted.delete().where(
+            accepted.c.id.not_in(
+                sa.select(sa.func.min(accepted.c.id)).group_by(
+                    accepted.c.user, accepted.c.token_id
+                )
+            )
+        )
+    )
+    with op.batch_alter_table("accepted") as batch_op:
+        batch_op.create_unique_constraint(
+            "uq_accepted_user_token_id", ["user", "token_id"]
+        )
+
+
+def downgrade() -> None:
+    with op.batch_alter_table("accepted") as batch_op:
+        batch_op.drop_constraint("uq_accepted_user_token_id", type_="unique")
+    op.drop_index("ix_accepted_token_id", table_name="accepted")
+    op.drop_index("ix_tokens_owner_active", table_name="tokens")
+    op.drop_index("ix_tokens_owner_deleted_at", table_name="tokens")
@@ -1,7 +1,19 @@
 from typing import List
 from uuid import uuid4
 
-from sqlalchemy import Boolean, Column, DateTime, ForeignKey, String, Table, func
+from sqlalchemy import (
+    Boolean,
+    Column,
+    DateTime,
+    ForeignKey,
+    Index,
+    LargeBinary,
+    String,
+    Table,
+    UniqueConstraint,
+    func,
+    text,
+)
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
 
 
@@ -9,6 +21,10 @@ def uuid_short() -> str:
     return str(uuid4()).split("-")[0]
 
 
+def uuid_long() -> str:
+    return str(uuid4())
+
+
 class Base(DeclarativeBase):
     pass
 
@@ -23,6 +39,18 @@ token_rooms = Table(
 
 class Token(Base):
     __tablename__ = "tokens"
+    __table_args__ = (
+        Index("ix_tokens_owner_deleted_at", "owner", "deleted_at"),
+        # the listing only ever looks at the tokens not deleted, in this order
+        Index(
+            "ix_tokens_owner_active",
+            "owner",
+            "created_at",
+            "token",
+            postgresql_where=text("deleted_at IS NULL"),
+            sqlite_where=text("deleted_at IS NULL"),
+        ),
+    )
     token: Mapped[str] = mapped_column(String(50), default=uuid_short, primary_key=True)
     owner: Mapped[str] = mapped_column(String(255))
     create_dm: Mapped[bool] = mapped_column(Boolean)
@@ -60,6 +88,10 @@ class Room(Base):
 
 class Accepted(Base):
     __tablename__ = "accepted"
+    __table_args__ = (
+        UniqueConstraint("user", "token_id", name="uq_accepted_user_token_id"),
+        Index("ix_accepted_token_id", "token_id"),
+    )
     id: Mapped[int] = mapped_column(primary_key=True)
     user: Mapped[str] = mapped_column(String(255))
     errors: Mapped[str] = mapped_column(String(1024), nullable=True)
@@ -72,3 +104,80 @@ class Accepted(Base):
     updated_at = mapped_column(
         DateTime(timezone=True), server_default=func.now(), onupdate=func.now()
     )
+
+
+# status of a redeem job
+JOB_PENDING = "pending"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+
+# status of a single room of a redeem job
+ROOM_PENDING = "pending"
+ROOM_JOINED = "joined"
+ROOM_FAILED = "failed"
+
+
+class RedeemJob(Base):
+    __tablename__ = "redeem_jobs"
+    __table_args__ = (
+        Index("ix_redeem_jobs_status", "status"),
+        Index("ix_redeem_jobs_user_token_id", "user", "token_id"),
+        # retries of a redeem with the same key find the same job
+        Index(
+            "ix_redeem_jobs_user_idempotency_key",
+            "user",
+            "idempotency_key",
+            unique=True,
+        ),
+    )
+    id: Mapped[str] = mapped_column(String(50), default=uuid_long, primary_key=True)
+    user: Mapped[str] = mapped_column(String(255))
+    status: Mapped[str] = mapped_column(String(20), default=JOB_PENDING)
+    create_dm: Mapped[bool] = mapped_column(Boolean)
+    dm_room_id: Mapped[str] = mapped_column(String(255), nullable=True)
+    error: Mapped[str] = mapped_column(String(1024), nullable=True)
+    idempotency_key: Mapped[str] = mapped_column(String(255), nullable=True)
+
+    token_id = mapped_column(ForeignKey("tokens.token"))
+    token = relationship("Token")
+    rooms: Mapped[List["RedeemJobRoom"]] = relationship(back_populates="job")
+
+    # meta
+    created_at = mapped_column(DateTime(timezone=True), server_default=func.now())
+    updated_at = mapped_column(
+        DateTime(timezone=True), server_default=func.now(), onupdate=func.now()
+    )
+
+    def __repr__(self) -> str:
+        return f"RedeemJob({self.id!r}, status={self.status!r})"
+
+
+class RedeemJobRoom(Base):
+    __tablename__ = "redeem_job_rooms"
+    job_id: Mapped[str] = mapped_column(ForeignKey("redeem_jobs.id"), primary_key=True)
+    room: Mapped[str] = mapped_column(String(255), primary_key=True)
+    status: Mapped[str] = mapped_column(String(20), default=ROOM_PENDING)
+    error: Mapped[str] = mapped_column(String(1024), nullable=True)
+
+    job: Mapped[RedeemJob] = relationship(back_populates="rooms")
+
+    # meta
+    updated_at = mapped_column(
+        DateTime(timezone=True), server_default=func.now(), onupdate=func.now()
+    )
+
+
+class ShareFile(Base):
+    """A share link page or image, for `share_link_generator.storage: sql`."""
+
+    __tablename__ = "share_files"
+    name: Mapped[str] = mapped_column(String(255), primary_key=True)
+    # sha1 of the data, the same on all workers
+    version: Mapped[str] = mapped_column(String(40))
+    data: Mapped[bytes] = mapped_column(LargeBinary)
+
+    # meta
+    updated_at = mapped_column(
+        DateTime(timezone=True), server_default=func.now(), onupdate=func.now()
+    )
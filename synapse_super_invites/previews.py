@@ -0,0 +1,149 @@
+import io
+import threading
+from typing import Any, Dict, List, Sequence, Tuple
+
+from PIL import Image, ImageDraw, ImageFont
+
+from .config import ShareLinkGeneratorConfig
+
+Size = Tuple[int, int]
+
+# suffix of the file name and size of the preview images we generate
+PREVIEW_SIZES: Sequence[Tuple[str, Size]] = (
+    ("", (1200, 630)),
+    ("_square", (1200, 1200)),
+)
+
+MARGIN = 60
+ACCENT_HEIGHT = 16
+ACCENT = (18, 102, 241)
+TEXT = (20, 20, 20)
+MUTED = (96, 96, 96)
+# the only size color emoji fonts come in
+EMOJI_SIZE = 109
+
+FontType = ImageFont.FreeTypeFont | ImageFont.ImageFont
+
+
+def _fit(text: str, font: FontType, width: int) -> str:
+    if font.getlength(text) <= width:
+        return text
+    while text and font.getlength(text + "…") > width:
+        text = text[:-1]
+    return text + "…"
+
+
+def _wrap(text: str, font: FontType, width: int, max_lines: int) -> List[str]:
+    lines: List[str] = []
+    current = ""
+    for word in text.split():
+        candidate = "{c} {w}".format(c=current, w=word) if current else word
+        if current and font.getlength(candidate) > width:
+            lines.append(current)
+            current = word
+        else:
+            current = candidate
+    if current:
+        lines.append(current)
+
+    if len(lines) > max_lines:
+        lines = lines[:max_lines]
+        lines[-1] += "…"
+    # a single word can still be too long, e.g. a user id
+    return [_fit(line, font, width) for line in lines]
+
+
+class PreviewRenderer:
+    """Renders the social preview images of a share link.
+
+    The base layer of each size is drawn once and copied for every image.
+    Fonts are loaded once per generating thread, as freetype faces must not
+    be used by several threads at the same time.
+    """
+
+    def __init__(self, config: ShareLinkGeneratorConfig):
+        self.config = config
+        self._fonts = threading.local()
+        self._bases: Dict[Size, Image.Image] = {}
+        for _suffix, size in PREVIEW_SIZES:
+            base = Image.new("RGB", size, "white")
+            ImageDraw.Draw(base).rectangle((0, 0, size[0], ACCENT_HEIGHT), fill=ACCENT)
+            self._bases[size] = base
+
+    def _font(self, size: int) -> FontType:
+        fonts: Dict[Any, FontType] = self._fonts.__dict__
+        if size not in fonts:
+            if self.config.preview_font_path is not None:
+                fonts[size] = ImageFont.truetype(self.config.preview_font_path, size)
+            else:
+                fonts[size] = ImageFont.load_default(size)
+        return fonts[size]
+
+    def _emoji_font(self) -> FontType | None:
+        if self.config.preview_emoji_font_path is None:
+            # the other fonts don't have the glyphs
+            return None
+        fonts: Dict[Any, FontType] = self._fonts.__dict__
+        if "emoji" not in fonts:
+            fonts["emoji"] = ImageFont.truetype(
+                self.config.preview_emoji_font_path, EMOJI_SIZE
+            )
+        return fonts["emoji"]
+
+    def render(
+        self,
+        size: Size,
+        headline: str,
+        subline: str | None,
+        sharer: str,
+        icon: str | None,
+        qr_matrix: List[List[bool]],
+    ) -> bytes:
+        width, height = size
+        im = self._bases[size].copy()
+        draw = ImageDraw.Draw(im)
+
+        # the QR code goes bottom right, as large as the layout allows
+        qr_size = min(height - ACCENT_HEIGHT - 2 * MARGIN, width // 3)
+        modules = len(qr_matrix)
+        qr = Image.new("1", (modules, modules), 1)
+        qr.putdata([0 if dark else 1 for row in qr_matrix for dark in row])
+        qr = qr.resize((qr_size, qr_size), Image.Resampling.NEAREST)
+        im.paste(qr, (width - MARGIN - qr_size, height - MARGIN - qr_size))
+
+        if width > height:
+            # landscape: text to the left of the code
+            text_width = width - qr_size - 3 * MARGIN
+        else:
+            text_width = width - 2 * MARGIN
+
+        y = ACCENT_HEIGHT + MARGIN
+        emoji_font = self._emoji_font()
+        if icon and emoji_font is not None:
+            draw.text((MARGIN, y), icon, font=emoji_font, embedded_color=True)
+            y += EMOJI_SIZE + MARGIN // 2
+
+        headline_font = self._font(72)
+        for line in _wrap(headline, headline_font, text_width, 3):
+            draw.text((MARGIN, y), line, font=headline_font, fill=TEXT)
+            y += 84
+
+        if subline:
+            sub_font = self._font(44)
+            for line in _wrap(subline, sub_font, text_width, 2):
+                draw.text((MARGIN, y + 12), line, font=sub_font, fill=MUTED)
+                y += 56
+
+        sharer_font = self._font(36)
+        # on the bottom line, next to the code in either layout
+        sharer_width = width - qr_size - 3 * MARGIN
+        draw.text(
+            (MARGIN, height - MARGIN - 36),
+            _fit("shared by {s}".format(s=sharer), sharer_font, sharer_width),
+            font=sharer_font,
+            fill=MUTED,
+        )
+
+        out = io.BytesIO()
+        im.save(out, format=self.config.preview_format)
+        return out.getvalue()
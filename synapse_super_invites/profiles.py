@@ -0,0 +1,45 @@
+from synapse.module_api import ModuleApi
+from synapse.storage.roommember import ProfileInfo
+from synapse.types import UserID
+from synapse.util.caches.expiringcache import ExpiringCache
+
+from .config import SynapseSuperInvitesConfig
+
+
+class ProfileCache:
+    """Keeps the profiles of inviters around for a while, as the same few are
+    looked up again for every invitee opening their link.
+
+    Entries are dropped as soon as synapse tells us about a profile change.
+    Changes made on another worker aren't reported to us though, for those
+    `profile_cache_ttl_ms` bounds how long a stale profile is served.
+    """
+
+    def __init__(self, config: SynapseSuperInvitesConfig, api: ModuleApi):
+        self.api = api
+        self._cache: ExpiringCache[str, ProfileInfo] = ExpiringCache(
+            "super_invites_profiles",
+            # FIXME: it'd be great if we didn't have to resort to using internal args...
+            api._clock,
+            max_len=config.profile_cache_size,
+            expiry_ms=config.profile_cache_ttl_ms,
+        )
+
+    async def get(self, user_id: str) -> ProfileInfo:
+        profile = self._cache.get(user_id)
+        if profile is None:
+            profile = await self.api._store.get_profileinfo(UserID.from_string(user_id))
+            self._cache[user_id] = profile
+        return profile
+
+    def invalidate(self, user_id: str) -> None:
+        self._cache.pop(user_id, None)
+
+    async def on_profile_update(
+        self,
+        user_id: str,
+        new_profile: ProfileInfo,
+        by_admin: bool,
+        deactivation: bool,
+    ) -> None:
+        self.invalidate(user_id)
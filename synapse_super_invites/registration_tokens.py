@@ -0,0 +1,91 @@
+from typing import Collection, List
+
+from synapse.module_api import ModuleApi
+from synapse.storage.database import LoggingTransaction
+from synapse.types import JsonDict
+from synapse.util.caches.expiringcache import ExpiringCache
+from synapse.util.iterutils import batch_iter
+
+from .config import SynapseSuperInvitesConfig
+
+# tokens remembered as registration tokens, and for how long. An admin
+# deleting one is only noticed once it has expired here
+KNOWN_TOKENS = 10000
+KNOWN_TOKENS_TTL_MS = 10 * 60 * 1000
+# keeps the `IN (...)` lists within what every database accepts
+BATCH_SIZE = 500
+
+
+class RegistrationTokens:
+    """Makes our tokens usable as synapse registration tokens too.
+
+    All tokens of a write are provisioned in a single transaction on synapse's
+    database, and tokens we know to be registration tokens already are
+    skipped without asking the database at all.
+    """
+
+    def __init__(self, config: SynapseSuperInvitesConfig, api: ModuleApi):
+        self.config = config
+        self.api = api
+        self._known: ExpiringCache[str, bool] = ExpiringCache(
+            "super_invites_registration_tokens",
+            # FIXME: it'd be great if we didn't have to resort to using internal args...
+            api._clock,
+            max_len=KNOWN_TOKENS,
+            expiry_ms=KNOWN_TOKENS_TTL_MS,
+        )
+
+    def _create_missing_txn(
+        self, txn: LoggingTransaction, token_ids: List[str]
+    ) -> None:
+        # FIXME: it'd be great if we didn't have to resort to using internal args...
+        db_pool = self.api._store.db_pool
+        for batch in batch_iter(token_ids, BATCH_SIZE):
+            existing = {
+                token
+                for (token,) in db_pool.simple_select_many_txn(
+                    txn,
+                    "registration_tokens",
+                    column="token",
+                    iterable=batch,
+                    keyvalues={},
+                    retcols=["token"],
+                )
+            }
+            # unlimited uses, no expiry
+            rows = [
+                (token, None, 0, 0, None) for token in batch if token not in existing
+            ]
+            if rows:
+                db_pool.simple_insert_many_txn(
+                    txn,
+                    "registration_tokens",
+                    keys=(
+                        "token",
+                        "uses_allowed",
+                        "pending",
+                        "completed",
+                        "expiry_time",
+                    ),
+                    values=rows,
+                )
+
+    async def provide(self, token_ids: Collection[str], requested: bool) -> JsonDict:
+        """Make the tokens usable as registration tokens too, if requested
+        and enabled. Returns the `registration_token` info for the response."""
+        if not requested:
+            return {"valid": False, "reason": "NOT_REQUESTED"}
+        if not self.config.generate_registration_token:
+            return {"valid": False, "reason": "NOT_ENABLED"}
+
+        missing = [token for token in token_ids if self._known.get(token) is None]
+        if missing:
+            # FIXME: it'd be great if we didn't have to resort to using internal args...
+            await self.api._store.db_pool.runInteraction(
+                "super_invites_create_registration_tokens",
+                self._create_missing_txn,
+                missing,
+            )
+            for token in missing:
+                self._known[token] = True
+        return {"valid": True}
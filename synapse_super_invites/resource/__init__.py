@@ -1,8 +1,10 @@
+from .bulk_tokens import BulkTokensResource
 from .info import TokenInfoResource
 from .redeem import RedeemResource
+from .redeem_jobs import RedeemJobsResource
 from .tokens import TokensResource
 from .web_access import WebAccessResource
 from .share_link import ShareLink
 
-__all__ = ["RedeemResource", "TokenInfoResource",
+__all__ = ["BulkTokensResource", "RedeemResource", "RedeemJobsResource", "TokenInfoResource",
            "TokensResource", "WebAccessResource", "ShareLink"]
@@ -1,5 +1,7 @@
-from sqlalchemy import select
-from sqlalchemy.orm import sessionmaker
+from typing import Any, Callable, Collection, Dict, List, TypeVar, cast
+
+from sqlalchemy import Table, select, tuple_
+from sqlalchemy.orm import Session
 from synapse.http.server import (
     DirectServeJsonResource,
 )
@@ -7,7 +9,11 @@ from synapse.module_api import ModuleApi
 from synapse.types import JsonDict, Requester
 
 from synapse_super_invites.config import SynapseSuperInvitesConfig
-from synapse_super_invites.model import Token
+from synapse_super_invites.database import AnyDatabase, insert_or_ignore
+from synapse_super_invites.model import Accepted, Room, Token, token_rooms
+from synapse_super_invites.token_cache import TokenCache
+
+R = TypeVar("R")
 
 
 def can_edit_token(token: Token, requester: Requester) -> bool:
@@ -15,13 +21,26 @@ def can_edit_token(token: Token, requester: Requester) -> bool:
     return token.owner == str(requester.user)
 
 
-def serialize_token(token: Token) -> JsonDict:
-    return {
+# the optional fields of a serialized token
+TOKEN_FIELDS = ("accepted_count", "rooms")
+
+
+def serialize_token(
+    token: Token,
+    accepted_count: int | None = None,
+    fields: Collection[str] = TOKEN_FIELDS,
+) -> JsonDict:
+    data: JsonDict = {
         "token": token.token,
         "create_dm": token.create_dm,
-        "accepted_count": len(token.accepted),
-        "rooms": [r.nameOrAlias for r in token.rooms],
     }
+    if "accepted_count" in fields:
+        if accepted_count is None:
+            accepted_count = len(token.accepted)
+        data["accepted_count"] = accepted_count
+    if "rooms" in fields:
+        data["rooms"] = [r.nameOrAlias for r in token.rooms]
+    return data
 
 
 def token_query(token_id: str):  # type: ignore[no-untyped-def]
@@ -30,11 +49,74 @@ def token_query(token_id: str):  # type: ignore[no-untyped-def]
     )
 
 
+def has_redeemed(session: Session, token_id: str, user_id: str) -> bool:
+    return (
+        session.scalar(
+            select(Accepted.id).where(
+                Accepted.user == user_id, Accepted.token_id == token_id
+            )
+        )
+        is not None
+    )
+
+
+def _insert_missing(session: Session, table: Table, rows: List[Dict[str, Any]]) -> None:
+    if not rows:
+        return
+    statement = insert_or_ignore(session, table)
+    if statement is not None:
+        # a single statement, the database skips what's already there
+        session.execute(statement, rows)
+        return
+
+    keys = [column.name for column in table.primary_key]
+    existing = set(
+        session.execute(
+            select(*table.primary_key).where(
+                tuple_(*table.primary_key).in_(
+                    [tuple(r[k] for k in keys) for r in rows]
+                )
+            )
+        ).tuples()
+    )
+    rows = [r for r in rows if tuple(r[k] for k in keys) not in existing]
+    if rows:
+        session.execute(table.insert(), rows)
+
+
+def upsert_rooms(session: Session, room_ids: Collection[str]) -> None:
+    """Make sure all the rooms exist, in one round trip."""
+    _insert_missing(
+        session,
+        # always a Table for a declarative model
+        cast(Table, Room.__table__),
+        [{"nameOrAlias": room_id} for room_id in room_ids],
+    )
+
+
+def add_token_rooms(session: Session, token_id: str, room_ids: Collection[str]) -> None:
+    """Associate the rooms with the token, if they aren't already."""
+    _insert_missing(
+        session,
+        token_rooms,
+        [{"token": token_id, "room": room_id} for room_id in room_ids],
+    )
+
+
 class SuperInviteResourceBase(DirectServeJsonResource):
     def __init__(
-        self, config: SynapseSuperInvitesConfig, api: ModuleApi, sessions: sessionmaker  # type: ignore[type-arg]
+        self,
+        config: SynapseSuperInvitesConfig,
+        api: ModuleApi,
+        db: AnyDatabase,
+        tokens: TokenCache,
     ):
         super().__init__()
         self.config = config
         self.api = api
-        self.db = sessions
+        self.db = db
+        self.tokens = tokens
+
+    async def run_db(self, func: Callable[..., R], *args: Any) -> R:
+        # all session work happens on the db thread pool, never on the reactor
+        return await self.db.run(func, *args)
@@ -0,0 +1,151 @@
+from typing import Any, Dict, List, Set
+
+from sqlalchemy import insert, select
+from sqlalchemy.orm import Session
+from synapse.http.servlet import parse_json_object_from_request
+from synapse.http.site import SynapseRequest
+from synapse.module_api import ModuleApi
+from synapse.types import JsonDict, Tuple  # type: ignore[attr-defined]
+
+from synapse_super_invites.config import SynapseSuperInvitesConfig
+from synapse_super_invites.database import AnyDatabase
+from synapse_super_invites.model import Token, token_rooms, uuid_short
+from synapse_super_invites.registration_tokens import RegistrationTokens
+from synapse_super_invites.token_cache import TokenCache
+
+from .base import SuperInviteResourceBase, upsert_rooms
+
+MAX_BULK_TOKENS = 1000
+
+
+def _parse_specs(payload: JsonDict) -> List[Dict[str, Any]] | str:
+    """The tokens to create from either a `tokens` list of specs or a `count`
+    of tokens sharing the same `rooms` and `create_dm`. Returns an error
+    message if they aren't valid."""
+    count = payload.get("count")
+    if "tokens" in payload:
+        specs = payload["tokens"]
+        if not isinstance(specs, list):
+            return "tokens must be a list"
+        count = len(specs)
+    elif not isinstance(count, int) or isinstance(count, bool):
+        return "either tokens or count is required"
+
+    # checked before building anything from the count
+    if not 0 < count <= MAX_BULK_TOKENS:
+        return "between 1 and {max} tokens can be created at once".format(
+            max=MAX_BULK_TOKENS
+        )
+    if "tokens" not in payload:
+        specs = [
+            {"rooms": payload.get("rooms", []), "create_dm": payload.get("create_dm")}
+        ] * count
+
+    parsed = []
+    for spec in specs:
+        if not isinstance(spec, dict):
+            return "token specs must be objects"
+        rooms = spec.get("rooms", [])
+        if not isinstance(rooms, list) or not all(isinstance(r, str) for r in rooms):
+            return "rooms must be a list of room ids or aliases"
+        token_id = spec.get("token")
+        if token_id is not None and not isinstance(token_id, str):
+            return "token must be a string"
+        parsed.append(
+            {
+                "token": token_id,
+                # the same room twice would break the association's primary key
+                "rooms": list(dict.fromkeys(rooms)),
+                "create_dm": bool(spec.get("create_dm", False)),
+            }
+        )
+    return parsed
+
+
+class BulkTokensResource(SuperInviteResourceBase):
+    def __init__(
+        self,
+        config: SynapseSuperInvitesConfig,
+        api: ModuleApi,
+        db: AnyDatabase,
+        tokens: TokenCache,
+        registration_tokens: RegistrationTokens,
+    ):
+        super().__init__(config, api, db, tokens)
+        self.registration_tokens = registration_tokens
+
+    async def _async_render_POST(self, request: SynapseRequest) -> Tuple[int, JsonDict]:
+        requester = await self.api.get_user_by_req(request, allow_guest=False)
+        owner = str(requester.user)
+        payload = parse_json_object_from_request(request)
+        as_registration_token = payload.get("as_registration_token", True)
+
+        specs = _parse_specs(payload)
+        if isinstance(specs, str):
+            return 400, {"error": specs, "errcode": "INVALID_PARAM"}
+
+        payload_ids = {spec["token"] for spec in specs if spec["token"] is not None}
+
+        def _create_tokens(session: Session) -> Tuple[int, JsonDict]:
+            requested = [spec["token"] for spec in specs if spec["token"] is not None]
+            if len(payload_ids) != len(requested):
+                return 400, {"error": "Duplicate token ids", "errcode": "INVALID_PARAM"}
+            existing = set(
+                session.scalars(select(Token.token).where(Token.token.in_(requested)))
+            )
+            if existing:
+                return 400, {
+                    "error": "Tokens already exist: {t}".format(
+                        t=", ".join(sorted(existing))
+                    ),
+                    "errcode": "TOKEN_EXISTS",
+                }
+
+            taken: Set[str] = set(payload_ids)
+            for spec in specs:
+                if spec["token"] is None:
+                    while spec["token"] is None or spec["token"] in taken:
+                        spec["token"] = uuid_short()
+                    taken.add(spec["token"])
+            generated = [
+                spec["token"] for spec in specs if spec["token"] not in payload_ids
+            ]
+            if session.scalar(select(Token.token).where(Token.token.in_(generated))):
+                # so unlikely that trying again is good enough
+                return 409, {"error": "Please try again", "errcode": "TOKEN_EXISTS"}
+
+            # rooms, tokens and their associations, one statement each
+            upsert_rooms(
+                session, dict.fromkeys(r for spec in specs for r in spec["rooms"])
+            )
+            session.execute(
+                insert(Token),
+                [
+                    {
+                        "token": spec["token"],
+                        "owner": owner,
+                        "create_dm": spec["create_dm"],
+                    }
+                    for spec in specs
+                ],
+            )
+            associations = [
+                {"token": spec["token"], "room": room_id}
+                for spec in specs
+                for room_id in spec["rooms"]
+            ]
+            if associations:
+                session.execute(insert(token_rooms), associations)
+            return 200, {"tokens": [spec["token"] for spec in specs]}
+
+        code, response = await self.run_db(_create_tokens)
+        if code != 200:
+            return code, response
+        for token_id in payload_ids:
+            # might have been looked up, and cached as missing, before
+            await self.tokens.invalidate(token_id)
+
+        response["registration_token"] = await self.registration_tokens.provide(
+            response["tokens"], as_registration_token
+        )
+        return 200, response
@@ -1,55 +1,58 @@
-from sqlalchemy import select
 from synapse.http.servlet import parse_string
 from synapse.http.site import SynapseRequest
-from synapse.types import JsonDict, Tuple, UserID  # type: ignore[attr-defined]
+from synapse.module_api import ModuleApi
+from synapse.types import JsonDict, Tuple  # type: ignore[attr-defined]
 
-from synapse_super_invites.model import Accepted, Token
-from .base import SuperInviteResourceBase
+from synapse_super_invites.config import SynapseSuperInvitesConfig
+from synapse_super_invites.database import AnyDatabase
+from synapse_super_invites.profiles import ProfileCache
+from synapse_super_invites.token_cache import TokenCache
+
+from .base import SuperInviteResourceBase, has_redeemed
 
 
 class TokenInfoResource(SuperInviteResourceBase):
+    def __init__(
+        self,
+        config: SynapseSuperInvitesConfig,
+        api: ModuleApi,
+        db: AnyDatabase,
+        tokens: TokenCache,
+        profiles: ProfileCache,
+    ):
+        super().__init__(config, api, db, tokens)
+        self.profiles = profiles
+
     async def _async_render_GET(self, request: SynapseRequest) -> Tuple[int, JsonDict]:
         requester = await self.api.get_user_by_req(request, allow_guest=False)
         my_id = str(requester.user)
         token_id = parse_string(request, "token", required=True)
-        with self.db.begin() as session:
-            token = session.scalar(
-                select(Token).where(Token.token == token_id)  # noqa: E711
-            )
-            if not token:
-                return 403, {"error": "Token not found", "errcode": "NOT_FOUND"}
-
-            if token.deleted_at is not None:
-                return 403, {
-                    "error": "Token not longer valid",
-                    "errcode": "CANT_REDEEM",
-                }
-
-            has_redeemed = (
-                session.scalar(
-                    select(Accepted).where(
-                        Accepted.user == my_id, Accepted.token == token
-                    )
-                )
-                is not None
-            )
-
-            rooms_count = len(token.rooms)
-            if token.create_dm:
-                rooms_count += 1
-
-            user_id = token.owner
-            owner_info = await self.api._store.get_profileinfo(
-                UserID.from_string(user_id)
-            )
-
-            return 200, {
-                "rooms_count": rooms_count,
-                "has_redeemed": has_redeemed,
-                "create_dm": token.create_dm,
-                "inviter": {
-                    "user_id": user_id,
-                    "display_name": owner_info.display_name,
-                    "avatar_url": owner_info.avatar_url,
-                },
+
+        token = await self.tokens.get_token(token_id)
+        if not token:
+            return 403, {"error": "Token not found", "errcode": "NOT_FOUND"}
+
+        if token.deleted:
+            return 403, {
+                "error": "Token not longer valid",
+                "errcode": "CANT_REDEEM",
             }
+
+        redeemed = await self.run_db(has_redeemed, token_id, my_id)
+
+        rooms_count = len(token.rooms)
+        if token.create_dm:
+            rooms_count += 1
+
+        owner_info = await self.profiles.get(token.owner)
+
+        return 200, {
+            "rooms_count": rooms_count,
+            "has_redeemed": redeemed,
+            "create_dm": token.create_dm,
+            "inviter": {
+                "user_id": token.owner,
+                "display_name": owner_info.display_name,
+                "avatar_url": owner_info.avatar_url,
+            },
+        }
@@ -1,103 +1,225 @@
 import logging
+from typing import Any, Dict, List
 
 from sqlalchemy import select
-from synapse.http.servlet import parse_string
+from sqlalchemy.orm import Session
+from synapse.http.servlet import parse_boolean, parse_string
 from synapse.http.site import SynapseRequest
+from synapse.module_api import ModuleApi
 from synapse.types import JsonDict, Tuple  # type: ignore[attr-defined]
 
-from synapse_super_invites.model import Accepted
+from synapse_super_invites.config import SynapseSuperInvitesConfig
+from synapse_super_invites.database import AnyDatabase
+from synapse_super_invites.jobs import (
+    RedeemJobs,
+    claim_job,
+    fail_job,
+    job_details,
+    joined_rooms,
+    reserve_redemption,
+)
+from synapse_super_invites.model import (
+    JOB_DONE,
+    JOB_FAILED,
+    JOB_PENDING,
+    JOB_RUNNING,
+    RedeemJob,
+    RedeemJobRoom,
+)
+from synapse_super_invites.token_cache import TokenCache
 
-from .base import SuperInviteResourceBase, token_query
+from .base import SuperInviteResourceBase
 
 logger = logging.getLogger(__name__)
 
 
+def _already_redeemed() -> Tuple[int, JsonDict]:
+    return 400, {
+        "error": "Token already redeemed found",
+        "errcode": "ALREADY_REDEEMED",
+    }
+
+
+def _in_token_order(rooms: List[str], token_rooms: List[str]) -> List[str]:
+    order = {room_id: i for i, room_id in enumerate(token_rooms)}
+    return sorted(rooms, key=lambda room_id: order.get(room_id, len(order)))
+
+
+def _new_job(
+    user_id: str, token_id: str, token: JsonDict, key: str | None, status: str
+) -> RedeemJob:
+    return RedeemJob(
+        user=user_id,
+        token_id=token_id,
+        status=status,
+        create_dm=token["create_dm"],
+        idempotency_key=key,
+        rooms=[RedeemJobRoom(room=room_id) for room_id in token["rooms"]],
+    )
+
+
 class RedeemResource(SuperInviteResourceBase):
+    def __init__(
+        self,
+        config: SynapseSuperInvitesConfig,
+        api: ModuleApi,
+        db: AnyDatabase,
+        tokens: TokenCache,
+        redeem_jobs: RedeemJobs,
+    ):
+        super().__init__(config, api, db, tokens)
+        self.redeem_jobs = redeem_jobs
+
+    async def _load_token(self, token_id: str, my_id: str) -> Tuple[int, JsonDict]:
+        token = await self.tokens.get_token(token_id)
+        if not token or token.deleted:
+            return 404, {"error": "Token not found", "errcode": "NOT_FOUND"}
+
+        if token.owner == my_id:
+            return 400, {
+                "error": "Can't redeem your own token",
+                "errcode": "CANT_REDEEM",
+            }
+
+        return 200, {
+            "owner": token.owner,
+            "create_dm": token.create_dm,
+            "rooms": list(token.rooms),
+        }
+
     async def _async_render_POST(self, request: SynapseRequest) -> Tuple[int, JsonDict]:
         requester = await self.api.get_user_by_req(request, allow_guest=False)
         my_id = str(requester.user)
         token_id = parse_string(request, "token", required=True)
-        invited_rooms = []
-        errors = []
-        with self.db.begin() as session:
-            token = session.scalar(token_query(token_id))
-            if not token:
-                return 404, {"error": "Token not found", "errcode": "NOT_FOUND"}
-
-            if session.scalar(
-                select(Accepted).where(Accepted.user == my_id, Accepted.token == token)
-            ):
-                return 400, {
-                    "error": "Token already redeemed found",
-                    "errcode": "ALREADY_REDEEMED",
-                }
-
-            if token.owner == my_id:
-                return 400, {
-                    "error": "Can't redeem your own token",
-                    "errcode": "CANT_REDEEM",
-                }
-
-            owner = token.owner
-            for room in token.rooms:
-                try:
-                    await self.api.update_room_membership(
-                        sender=owner,
-                        target=my_id,
-                        room_id=room.nameOrAlias,
-                        new_membership="invite",
-                    )
-
-                    await self.api.update_room_membership(
-                        sender=my_id,
-                        target=my_id,
-                        room_id=room.nameOrAlias,
-                        new_membership="join",
-                    )
-                    invited_rooms.append(room.nameOrAlias)
-                except Exception as e:
-                    errors.append(
-                        "{room_id} skipped: '{error}'".format(
-                            room_id=room.nameOrAlias, error=e
-                        )
-                    )
-                    logger.warning(
-                        "Skipping super invite{token}: Failed to add {user_id} to {room_id}: {error}".format(
-                            token=token_id,
-                            user_id=my_id,
-                            room_id=room.nameOrAlias,
-                            error=e,
-                        )
-                    )
-
-            if token.create_dm:
-                dm_data = await self.api.create_room(
-                    my_id,
-                    config={
-                        "preset": "trusted_private_chat",
-                        "invite": [owner],
-                        "is_direct": True,
-                        "initial_state": [
-                            {  # Encryption enabled
-                                "type": "m.room.encryption",
-                                "state_key": "",
-                                "content": {
-                                    "algorithm": "m.megolm.v1.aes-sha2",
-                                    "rotation_period_ms": 604800000,
-                                    "rotation_period_msgs": 100,
-                                },
-                            }
-                        ],
-                    },
-                )
-                invited_rooms.append(dm_data[0])
+        key = parse_string(request, "idempotency_key")
+        background = parse_boolean(request, "background", default=False)
+
+        code, token = await self._load_token(token_id, my_id)
+        if code != 200:
+            return code, token
 
-            error_msg = None
-            if len(errors) > 0:
-                error_msg = "\n".join(errors)[:1024]
+        code, response, job = await self.run_db(
+            self._start_job, token_id, my_id, token, key, background
+        )
+        if job is None:
+            return code, response
 
-            # keep the accepted record
-            session.add(Accepted(token=token, user=my_id, errors=error_msg))
-            session.flush()
+        try:
+            joined, dm_room_id = await self.redeem_jobs.run(job)
+        except Exception as e:
+            await self.run_db(fail_job, job["id"], str(e))
+            raise
 
+        # report in the order of the token's rooms
+        invited_rooms = _in_token_order(joined, token["rooms"])
+        if dm_room_id is not None:
+            invited_rooms.append(dm_room_id)
         return 200, {"rooms": invited_rooms}
+
+    def _start_job(
+        self,
+        session: Session,
+        token_id: str,
+        my_id: str,
+        token: JsonDict,
+        key: str | None,
+        background: bool,
+    ) -> Tuple[int, JsonDict, Dict[str, Any] | None]:
+        """Find or create the job of this redeem. Returns the response, and
+        the job if the request is to run it."""
+        if key is not None:
+            job = session.scalar(
+                select(RedeemJob).where(
+                    RedeemJob.user == my_id, RedeemJob.idempotency_key == key
+                )
+            )
+            if job is not None:
+                return self._retry_job(session, job, token_id, token, background)
+
+        if background:
+            code, response = self._enqueue_job(session, token_id, my_id, token, key)
+            return code, response, None
+
+        # claim it before doing any of the work, so a concurrent redeem of
+        # the same token by the same user bails out right here
+        if not reserve_redemption(session, token_id, my_id):
+            code, response = _already_redeemed()
+            return code, response, None
+
+        # progress is kept per room, like for background jobs
+        job = _new_job(my_id, token_id, token, key, JOB_RUNNING)
+        session.add(job)
+        session.flush()
+        return 200, {}, job_details(job)
+
+    def _retry_job(
+        self,
+        session: Session,
+        job: RedeemJob,
+        token_id: str,
+        token: JsonDict,
+        background: bool,
+    ) -> Tuple[int, JsonDict, Dict[str, Any] | None]:
+        if job.token_id != token_id:
+            return (
+                400,
+                {
+                    "error": "Idempotency key used for another token",
+                    "errcode": "INVALID_PARAM",
+                },
+                None,
+            )
+
+        if job.status == JOB_DONE:
+            # it went through, hand back the same result again
+            rooms = _in_token_order(joined_rooms(job), token["rooms"])
+            if job.dm_room_id is not None:
+                rooms.append(job.dm_room_id)
+            return 200, {"rooms": rooms}, None
+
+        if job.status in (JOB_PENDING, JOB_FAILED):
+            # a failed redeem gave up its claim on the token, which may have
+            # been redeemed without this key since
+            if job.status == JOB_FAILED and not reserve_redemption(
+                session, token_id, job.user
+            ):
+                code, response = _already_redeemed()
+                return code, response, None
+            if background:
+                job.status = JOB_PENDING
+                session.flush()
+            else:
+                claimed = claim_job(session, job.id, (JOB_PENDING, JOB_FAILED))
+                if claimed is not None:
+                    # only the rooms not joined yet are attempted again
+                    return 200, {}, claimed
+
+        # still going on elsewhere
+        return 202, {"job_id": job.id, "status": job.status}, None
+
+    def _enqueue_job(
+        self,
+        session: Session,
+        token_id: str,
+        my_id: str,
+        token: JsonDict,
+        key: str | None,
+    ) -> Tuple[int, JsonDict]:
+        # claimed right away: of concurrent redeems only one gets to queue a job
+        if not reserve_redemption(session, token_id, my_id):
+            # redeeming the same token again just hands back the queued job
+            queued = session.scalar(
+                select(RedeemJob).where(
+                    RedeemJob.user == my_id,
+                    RedeemJob.token_id == token_id,
+                    RedeemJob.status.in_([JOB_PENDING, JOB_RUNNING]),
+                )
+            )
+            if queued is None:
+                return _already_redeemed()
+            return 202, {"job_id": queued.id, "status": queued.status}
+
+        job = _new_job(my_id, token_id, token, key, JOB_PENDING)
+        session.add(job)
+        session.flush()
+        return 202, {"job_id": job.id, "status": job.status}
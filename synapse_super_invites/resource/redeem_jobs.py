@@ -0,0 +1,41 @@
+from sqlalchemy.orm import Session
+from synapse.http.servlet import parse_string
+from synapse.http.site import SynapseRequest
+from synapse.types import JsonDict, Tuple  # type: ignore[attr-defined]
+
+from synapse_super_invites.jobs import joined_rooms
+from synapse_super_invites.model import JOB_DONE, RedeemJob
+
+from .base import SuperInviteResourceBase
+
+
+class RedeemJobsResource(SuperInviteResourceBase):
+    async def _async_render_GET(self, request: SynapseRequest) -> Tuple[int, JsonDict]:
+        requester = await self.api.get_user_by_req(request, allow_guest=False)
+        my_id = str(requester.user)
+        job_id = parse_string(request, "job", required=True)
+
+        def _load_job(session: Session) -> Tuple[int, JsonDict]:
+            job = session.get(RedeemJob, job_id)
+            if not job or job.user != my_id:
+                return 404, {"error": "Job not found", "errcode": "NOT_FOUND"}
+
+            status: JsonDict = {
+                "job_id": job.id,
+                "token": job.token_id,
+                "status": job.status,
+                "error": job.error,
+                "progress": [
+                    {"room_id": room.room, "status": room.status, "error": room.error}
+                    for room in job.rooms
+                ],
+            }
+            if job.status == JOB_DONE:
+                # the same result a direct redeem would have given
+                rooms = joined_rooms(job)
+                if job.dm_room_id is not None:
+                    rooms.append(job.dm_room_id)
+                status["rooms"] = rooms
+            return 200, status
+
+        return await self.run_db(_load_job)
@@ -1,4 +1,5 @@
-from synapse.types import Dict, Any, Tuple, JsonDict, UserID
+from synapse.types import Dict, Any, Tuple, JsonDict
+from typing import Callable, List, Set, TypeVar
 import hashlib
 from synapse.http.server import (
     DirectServeHtmlResource,
@@ -8,34 +9,88 @@ from synapse.http.server import (
 )
 from synapse.storage.roommember import ProfileInfo
 from synapse.http.site import SynapseRequest
-from synapse.http.servlet import parse_json_object_from_request, parse_string
+from synapse.http.servlet import parse_boolean, parse_json_object_from_request, parse_string
+from synapse.logging.context import defer_to_threadpool
 from synapse.module_api import ModuleApi
+from synapse.util.async_helpers import yieldable_gather_results
+from synapse.util.caches.lrucache import LruCache
+from twisted.python.threadpool import ThreadPool
 from ..config import ShareLinkGeneratorConfig
+from ..files import BatchedWriter
+from ..previews import PREVIEW_SIZES, PreviewRenderer
+from ..profiles import ProfileCache
+from ..storage import FileStorage, ShareStorage, StoredFile, content_version
 
 from jinja2 import (
     Environment,
     PackageLoader,
     ChoiceLoader,
+    FileSystemBytecodeCache,
     FileSystemLoader,
     select_autoescape,
 )
-from PIL import Image, ImageDraw, ImageFont
 from urllib.parse import urlencode
 import qrcode
 import qrcode.image.svg
+import gzip
+import json
+import logging
 import os
+import re
+
+try:
+    import brotli  # type: ignore[import-untyped]
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+R = TypeVar("R")
 
 MY_DIR = os.path.dirname(os.path.realpath(__file__))
 
+MAX_BATCH_SIZE = 100
+
+# the files we generate: pages and their preview images
+SERVED_FILE = re.compile(r'^[0-9a-f]{40}(?:_square)?\.(html|png|webp)$')
+CONTENT_TYPES = {
+    'html': b'text/html; charset=utf-8',
+    'png': b'image/png',
+    'webp': b'image/webp',
+}
+# pre-compressed variants of the pages, in order of preference
+ENCODINGS = [('br', '.br'), ('gzip', '.gz')]
+
+
+def _accepted_encodings(request: SynapseRequest) -> Set[str]:
+    header = (request.getHeader(b'Accept-Encoding') or b'').decode('ascii', 'replace')
+    accepted = set()
+    for part in header.split(','):
+        encoding, _, params = part.partition(';')
+        q = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                pass
+        if q > 0:
+            accepted.add(encoding.strip().lower())
+    return accepted
+
 
 uriFormatter = "{uriPrefix}{hash}?{query}#{path}"
 acterUriFormatter = "acter:{path}?{query}"
 
 
 class ShareLink(DirectServeJsonResource):
+    # we handle all paths below ours ourselves
+    isLeaf = True
+
     def __init__(
         # type: ignore[type-arg]
-        self, config: ShareLinkGeneratorConfig, api: ModuleApi
+        self, config: ShareLinkGeneratorConfig, api: ModuleApi,
+        profiles: ProfileCache, storage: ShareStorage
     ):
         super().__init__()
         self.config = config
@@ -43,40 +98,233 @@ class ShareLink(DirectServeJsonResource):
         if config.template_path is not None:
             loaders.insert(0, FileSystemLoader(config.template_path))
 
+        bytecode_cache = None
+        if config.template_cache_dir is not None:
+            os.makedirs(config.template_cache_dir, exist_ok=True)
+            bytecode_cache = FileSystemBytecodeCache(config.template_cache_dir)
+
         self.env = Environment(
             loader=ChoiceLoader(loaders),
-            autoescape=select_autoescape()
+            autoescape=select_autoescape(),
+            auto_reload=config.auto_reload_templates,
+            bytecode_cache=bytecode_cache,
         )
+        # compile them all now rather than on the first share, this includes
+        # the parts only pulled in while rendering
+        for name in self.env.list_templates(extensions=["html"]):
+            self.env.get_template(name)
         self.template = self.env.get_template("share_link.html")
-        self.dir_path = config.target_path
+        self.storage = storage
         self.api = api
+        self.profiles = profiles
+        # QR codes, templates and files are all blocking work, kept off the reactor
+        # FIXME: it'd be great if we didn't have to resort to using internal args...
+        self._reactor = api._hs.get_reactor()
+        self._threadpool = ThreadPool(
+            minthreads=1, maxthreads=config.worker_threads, name="super_invites_share_link"
+        )
+        self._started = False
+        # hash -> digest of the params of the pages we've generated
+        self._pages: LruCache[str, str] = LruCache(
+            config.known_pages, "super_invites_share_link_pages")
+        self.previews: PreviewRenderer | None = None
+        if config.previews:
+            self.previews = PreviewRenderer(config)
+        # hash -> (version of the stored link, its rendered files) in lazy mode
+        self._rendered: LruCache[str, Tuple[str, Dict[str, Tuple[str, bytes]]]] = LruCache(
+            config.lazy_cache_bytes,
+            "super_invites_share_link_rendered",
+            size_callback=lambda rendered: sum(len(data) for _etag, data in rendered[1].values()),
+            apply_cache_factor_from_config=False,
+        )
+        self._writer: BatchedWriter | None = None
+        if config.write_behind_ms is not None:
+            self._writer = BatchedWriter(storage.write)
+            api.looping_background_call(
+                self._flush_pages,
+                config.write_behind_ms,
+                self._writer,
+                desc="super_invites_share_link_writes",
+                run_on_all_instances=True,
+            )
+        # the storage unused files are removed from
+        self._swept: FileStorage | None = None
+        if config.gc_max_age_ms is not None or config.gc_max_bytes is not None:
+            # the config only allows these with storage file
+            assert isinstance(storage, FileStorage)
+            self._swept = storage
+            api.looping_background_call(
+                self._sweep,
+                config.gc_interval_ms,
+                storage,
+                desc="super_invites_share_link_gc",
+                # each may have a directory of its own
+                run_on_all_instances=True,
+            )
+        self._reactor.addSystemEventTrigger(
+            "during", "shutdown", self._stop  # type: ignore[arg-type]
+        )
 
-    def _generate_qrcode(self, uri: str) -> str:
+    def _stop(self) -> None:
+        if self._writer is not None:
+            # don't lose what is still queued
+            self._writer.flush()
+        if self._started:
+            self._threadpool.stop()
+            self._started = False
+
+    async def _in_threadpool(self, func: Callable[..., R], *args: Any) -> R:
+        if not self._started:
+            self._threadpool.start()
+            self._started = True
+        return await defer_to_threadpool(self._reactor, self._threadpool, func, *args)
+
+    async def _flush_pages(self, writer: BatchedWriter) -> None:
+        await self._in_threadpool(writer.flush)
+
+    async def _sweep(self, storage: FileStorage) -> None:
+        max_age = None
+        if self.config.gc_max_age_ms is not None:
+            max_age = self.config.gc_max_age_ms / 1000
+        removed = await self._in_threadpool(storage.sweep, max_age, self.config.gc_max_bytes)
+        if removed:
+            logger.info("Removed {n} unused share link files".format(n=removed))
+
+    def _generate_qrcode(self, uri: str) -> Tuple[str, List[List[bool]]]:
         qr = qrcode.QRCode(image_factory=qrcode.image.svg.SvgPathFillImage)
         qr.add_data(uri)
         qr.make(fit=True)
         img = qr.make_image()
-        return img.to_string(encoding='unicode')
-
-    def _generate_og_image(self, targetHash: str, **params) -> str:
-        im = Image.new('RGB', (1200, 630), 'white')
-        file_name = os.path.join(
-            self.dir_path, '{fn}.png'.format(fn=targetHash))
-        im.save(file_name)
-        return file_name
-
-    def _generate_square_image(self, targetHash: str, **params) -> str:
-        im = Image.new('RGB', (1200, 1200), 'white')
-        file_name = os.path.join(
-            self.dir_path, '{fn}_square.png'.format(fn=targetHash))
-        im.save(file_name)
-        return file_name
-
-    def _generate_template(self, targetHash: str, params: Dict[Any, Any]):
-        file_name = os.path.join(
-            self.dir_path, '{fn}.html'.format(fn=targetHash))
-        with open(file_name, mode='w') as f:
-            f.write(self.template.render(params))
+        # the matrix is reused for the preview images
+        return img.to_string(encoding='unicode'), qr.get_matrix()
+
+    def _write_files(self, files: Dict[str, bytes]) -> None:
+        if self._writer is not None:
+            for file_name, data in files.items():
+                self._writer.add(file_name, data)
+        else:
+            self.storage.write(files)
+
+    def _version(self, file_name: str) -> str | None:
+        if self._writer is not None:
+            data = self._writer.get(file_name)
+            if data is not None:
+                return content_version(data)
+        return self.storage.version(file_name)
+
+    def _read(self, file_name: str) -> StoredFile | None:
+        if self._writer is not None:
+            data = self._writer.get(file_name)
+            if data is not None:
+                # not written yet, but we can serve it already
+                return StoredFile(content_version(data), data)
+        return self.storage.read(file_name)
+
+    def _touch(self, targetHash: str) -> None:
+        # keeps its files from being swept while it is still shared or viewed
+        if self._swept is None:
+            return
+        if self.config.lazy:
+            self._swept.touch('{fn}.json'.format(fn=targetHash))
+        else:
+            self._swept.touch('{fn}.html'.format(fn=targetHash))
+
+    def _preview_files(self, targetHash: str) -> List[Tuple[str, Tuple[int, int]]]:
+        return [
+            ('{fn}{suffix}.{ext}'.format(fn=targetHash, suffix=suffix, ext=self.config.preview_format), size)
+            for suffix, size in PREVIEW_SIZES
+        ]
+
+    def _render_previews(self, previews: PreviewRenderer, targetHash: str, params: Dict[Any, Any], qr_matrix: List[List[bool]]) -> Dict[str, bytes]:
+        title = params.get('title')
+        room_name = params.get('roomDisplayName')
+        headline = (title or room_name or params.get('roomAlias')
+                    or params.get('userId') or params.get('roomId'))
+        subline = None
+        if title and room_name:
+            subline = 'in {room}'.format(room=room_name)
+        if not headline and params.get('inviteCode'):
+            headline = "You've been invited"
+        sharer = params.get('sharerDisplayName') or '@{u}'.format(u=params['sharerId'])
+
+        return {
+            file_name: previews.render(
+                size, headline or '', subline, sharer, params.get('icon'), qr_matrix)
+            for file_name, size in self._preview_files(targetHash)
+        }
+
+    def _render_files(self, targetHash: str, acter_uri: str, params: Dict[Any, Any]) -> Dict[str, bytes]:
+        """All the files of a share link by name, the page itself last."""
+        params = dict(params)
+        files = {}
+        params["qrcode"], qr_matrix = self._generate_qrcode(acter_uri)
+        if self.previews is not None:
+            files.update(self._render_previews(self.previews, targetHash, params, qr_matrix))
+            params["images"] = [
+                (self.config.url_prefix + fn, size)
+                for fn, size in self._preview_files(targetHash)
+            ]
+        template = self.template
+        if self.config.auto_reload_templates:
+            # picks up changes to the template
+            template = self.env.get_template("share_link.html")
+        page = template.render(params).encode()
+        page_name = '{fn}.html'.format(fn=targetHash)
+        if self.config.serve:
+            # pre-compressed variants, written first so they are never older
+            # than the page itself
+            files[page_name + '.gz'] = gzip.compress(page, mtime=0)
+            if brotli is not None:
+                files[page_name + '.br'] = brotli.compress(page)
+        files[page_name] = page
+        return files
+
+    def _generate_template(self, targetHash: str, acter_uri: str, params: Dict[Any, Any], force: bool = False) -> None:
+        # the hash only covers the link itself, the page also shows
+        # e.g. the sharer's current display name
+        digest = hashlib.sha1(
+            json.dumps(params, sort_keys=True).encode()).hexdigest()
+        if self.config.lazy:
+            # only rendered once it is asked for
+            file_names = ['{fn}.json'.format(fn=targetHash)]
+        else:
+            file_names = ['{fn}.html'.format(fn=targetHash)]
+            if self.previews is not None:
+                file_names += [fn for fn, _size in self._preview_files(targetHash)]
+        if (not force and self._pages.get(targetHash) == digest
+                and all(self._version(fn) is not None for fn in file_names)):
+            # nothing changed, no need to generate it again
+            self._touch(targetHash)
+            return
+
+        if self.config.lazy:
+            self._write_files({file_names[0]: json.dumps(
+                {'acter_uri': acter_uri, 'params': params}).encode()})
+        else:
+            self._write_files(self._render_files(targetHash, acter_uri, params))
+        self._pages[targetHash] = digest
+
+    def _lazy_files(self, targetHash: str) -> Dict[str, Tuple[str, bytes]] | None:
+        link_name = '{fn}.json'.format(fn=targetHash)
+        version = self._version(link_name)
+        if version is None:
+            return None
+
+        cached = self._rendered.get(targetHash)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+
+        # first time asked for, or the link has been shared again since
+        stored = self._read(link_name)
+        if stored is None:
+            return None
+        link = json.loads(stored.data)
+        files = {
+            file_name: ('"{h}"'.format(h=content_version(data)), data)
+            for file_name, data in self._render_files(targetHash, link['acter_uri'], link['params']).items()
+        }
+        self._rendered[targetHash] = (stored.version, files)
+        return files
 
     def _gen_uri(self, user_id: str, path: str, query: Dict[str, Any] | None = None) -> Tuple[str, str, str]:
         query_params = query or dict()
@@ -101,7 +349,7 @@ class ShareLink(DirectServeJsonResource):
             path=path,
         )
 
-    def _gen_spaceObject(self, user_id: str, owner_info: ProfileInfo, payload: Dict[str, Any]) -> Tuple[int, JsonDict]:
+    def _gen_spaceObject(self, user_id: str, owner_info: ProfileInfo, payload: Dict[str, Any], force: bool = False) -> Tuple[int, JsonDict]:
         query = payload.get('query', None) or {}
         return self._gen_spaceObjectInner(
             user_id=user_id,
@@ -112,9 +360,10 @@ class ShareLink(DirectServeJsonResource):
             title=query.get('title', None),
             via=query.get('via', None),
             room_display_name=query.get('roomDisplayName'),
+            force=force,
         )
 
-    def _gen_forRefObject(self, user_id: str, owner_info: ProfileInfo, payload: Dict[str, Any]) -> Tuple[int, JsonDict]:
+    def _gen_forRefObject(self, user_id: str, owner_info: ProfileInfo, payload: Dict[str, Any], force: bool = False) -> Tuple[int, JsonDict]:
         # import pdb
         # pdb.set_trace()
         preview = payload.get('preview', None) or {}
@@ -134,6 +383,7 @@ class ShareLink(DirectServeJsonResource):
             title=preview.get('title'),
             via=payload.get('via', None),
             room_display_name=preview.get('room_display_name'),
+            force=force,
         )
 
     def _gen_query(self,
@@ -154,7 +404,8 @@ class ShareLink(DirectServeJsonResource):
                               room_id: str, object_type: str, object_id: str,
                               title: str | None = None,
                               via: str | list[str] | None = None,
-                              room_display_name: str | None = None
+                              room_display_name: str | None = None,
+                              force: bool = False,
                               ) -> Tuple[int, JsonDict]:
         # cleaning up
         if room_id.startswith('!'):
@@ -169,7 +420,6 @@ class ShareLink(DirectServeJsonResource):
         targetHash, acter_uri, final_url = self._gen_uri(
             user_id=user_id, path=path, query=query)
 
-        qrcode = self._generate_qrcode(acter_uri)
         icon = '📗'
         if object_type == 'pin':
             icon = '📌'
@@ -184,7 +434,6 @@ class ShareLink(DirectServeJsonResource):
             sharerId=user_id,
             url=final_url,
             acter_uri=acter_uri,
-            qrcode=qrcode,
             icon=icon,
             objectId=object_id,
             title=title,
@@ -192,135 +441,234 @@ class ShareLink(DirectServeJsonResource):
             sharerDisplayName=owner_info.display_name,
             roomDisplayName=room_display_name
         )
-        self._generate_template(targetHash, params)
+        self._generate_template(targetHash, acter_uri, params, force)
 
         return 200, {
             'url': final_url,
             'targetUri': acter_uri,
         }
 
-    def _gen_superInvite(self, user_id: str, owner_info: ProfileInfo, payload: Dict[str, Any]) -> Tuple[int, JsonDict]:
+    def _gen_superInvite(self, user_id: str, owner_info: ProfileInfo, payload: Dict[str, Any], force: bool = False) -> Tuple[int, JsonDict]:
         path = "i/{server}/{inviteCode}".format(**payload)
         targetHash, acter_uri, final_url = self._gen_uri(
             user_id=user_id, path=path, query=payload.get('query'))
 
-        qrcode = self._generate_qrcode(acter_uri)
-
         query_params = payload.get('query', {}) or {}
         params = dict(
             sharerId=user_id,
             url=final_url,
             acter_uri=acter_uri,
-            qrcode=qrcode,
             icon='🎟️',
             inviteCode=payload.get('inviteCode', None),
             sharerDisplayName=owner_info.display_name,
             rooms=query_params.get(
                 'rooms', None),
         )
-        self._generate_template(targetHash, params)
+        self._generate_template(targetHash, acter_uri, params, force)
 
         return 200, {
             'url': final_url,
             'targetUri': acter_uri,
         }
 
-    def _gen_roomId(self, user_id: str, owner_info: ProfileInfo, payload: Dict[str, Any]) -> Tuple[int, JsonDict]:
+    def _gen_roomId(self, user_id: str, owner_info: ProfileInfo, payload: Dict[str, Any], force: bool = False) -> Tuple[int, JsonDict]:
         path = "roomid/{roomId}".format(**payload)
         targetHash, acter_uri, final_url = self._gen_uri(
             user_id=user_id, path=path, query=payload.get('query'))
 
-        qrcode = self._generate_qrcode(acter_uri)
-
         query_params = payload.get('query', {}) or {}
         params = dict(
             sharerId=user_id,
             url=final_url,
             acter_uri=acter_uri,
-            qrcode=qrcode,
             icon='#️⃣',
             roomId=payload.get('roomId', None),
             sharerDisplayName=owner_info.display_name,
             roomDisplayName=query_params.get(
                 'roomDisplayName', None),
         )
-        self._generate_template(targetHash, params)
+        self._generate_template(targetHash, acter_uri, params, force)
 
         return 200, {
             'url': final_url,
             'targetUri': acter_uri,
         }
 
-    def _gen_roomAlias(self, user_id: str, owner_info: ProfileInfo, payload: Dict[str, Any]) -> Tuple[int, JsonDict]:
+    def _gen_roomAlias(self, user_id: str, owner_info: ProfileInfo, payload: Dict[str, Any], force: bool = False) -> Tuple[int, JsonDict]:
         path = "r/{roomAlias}".format(**payload)
         targetHash, acter_uri, final_url = self._gen_uri(
             user_id=user_id, path=path, query=payload.get('query'))
 
-        qrcode = self._generate_qrcode(acter_uri)
-
         query_params = payload.get('query', {}) or {}
         params = dict(
             sharerId=user_id,
             url=final_url,
             acter_uri=acter_uri,
-            qrcode=qrcode,
             icon='#️⃣',
             roomAlias=payload.get('roomAlias', None),
             sharerDisplayName=owner_info.display_name,
             roomDisplayName=query_params.get(
                 'roomDisplayName', None),
         )
-        self._generate_template(targetHash, params)
+        self._generate_template(targetHash, acter_uri, params, force)
         return 200, {
             'url': final_url,
             'targetUri': acter_uri,
         }
 
-    def _gen_userId(self, user_id: str, owner_info: ProfileInfo, payload: Dict[str, Any]) -> Tuple[int, JsonDict]:
+    def _gen_userId(self, user_id: str, owner_info: ProfileInfo, payload: Dict[str, Any], force: bool = False) -> Tuple[int, JsonDict]:
         path = "u/{userId}".format(**payload)
         targetHash, acter_uri, final_url = self._gen_uri(
             user_id=user_id, path=path, query=payload.get('query'))
 
-        qrcode = self._generate_qrcode(acter_uri)
-
         query_params = payload.get('query', {}) or {}
         params = dict(
             sharerId=user_id,
             url=final_url,
             acter_uri=acter_uri,
-            qrcode=qrcode,
             userId=payload.get('userId'),
             sharerDisplayName=owner_info.display_name,
         )
-        self._generate_template(targetHash, params)
+        self._generate_template(targetHash, acter_uri, params, force)
 
         return 200, {
             'url': final_url,
             'targetUri': acter_uri,
         }
 
+    def _read_file(self, name: str, encodings: Set[str], if_none_match: Set[str]) -> Tuple[str, str | None, bytes | None] | None:
+        candidates = [
+            (name + suffix, encoding) for encoding, suffix in ENCODINGS if encoding in encodings
+        ] + [(name, None)]
+        for file_name, encoding in candidates:
+            version = self._version(file_name)
+            if version is not None:
+                used = encoding
+                break
+        else:
+            return None
+        self._touch(name[:40])
+
+        suffix = '-' + used if used else ''
+        etag = '"{v}{e}"'.format(v=version, e=suffix)
+        if etag in if_none_match or '*' in if_none_match:
+            return etag, used, None
+        stored = self._read(file_name)
+        if stored is None:
+            # removed in the meantime
+            return None
+        return '"{v}{e}"'.format(v=stored.version, e=suffix), used, stored.data
+
+    def _read_lazy(self, name: str, encodings: Set[str], if_none_match: Set[str]) -> Tuple[str, str | None, bytes | None] | None:
+        files = self._lazy_files(name[:40])
+        if files is None or name not in files:
+            return None
+        self._touch(name[:40])
+
+        used = None
+        for encoding, suffix in ENCODINGS:
+            if encoding in encodings and name + suffix in files:
+                name += suffix
+                used = encoding
+                break
+        etag, data = files[name]
+        if etag in if_none_match or '*' in if_none_match:
+            return etag, used, None
+        return etag, used, data
+
+    async def _async_render_GET(self, request: SynapseRequest) -> Tuple[int, JsonDict] | None:
+        if not self.config.serve:
+            return 404, {"error": "Not found", "errcode": "NOT_FOUND"}
+
+        name = (request.path or b'').rsplit(b'/', 1)[-1].decode('ascii', 'replace')
+        if '.' not in name:
+            # the share link itself
+            name += '.html'
+        match = SERVED_FILE.match(name)
+        if not match:
+            return 404, {"error": "Not found", "errcode": "NOT_FOUND"}
+        ext = match.group(1)
+
+        encodings: Set[str] = set()
+        if ext == 'html':
+            encodings = _accepted_encodings(request)
+        if_none_match = {
+            tag.strip().removeprefix('W/')
+            for tag in (request.getHeader(b'If-None-Match') or b'').decode('ascii', 'replace').split(',')
+        }
+        if self.config.lazy:
+            found = await self._in_threadpool(self._read_lazy, name, encodings, if_none_match)
+        else:
+            found = await self._in_threadpool(self._read_file, name, encodings, if_none_match)
+        if found is None:
+            return 404, {"error": "Not found", "errcode": "NOT_FOUND"}
+
+        etag, encoding, body = found
+        request.setHeader(b'ETag', etag.encode())  # type: ignore[no-untyped-call]
+        request.setHeader(b'Cache-Control', 'public, max-age={a}'.format(a=self.config.serve_max_age).encode())  # type: ignore[no-untyped-call]
+        if ext == 'html':
+            request.setHeader(b'Vary', b'Accept-Encoding')  # type: ignore[no-untyped-call]
+        if body is None:
+            request.setResponseCode(304)  # type: ignore[no-untyped-call]
+            finish_request(request)
+            return None
+
+        request.setResponseCode(200)  # type: ignore[no-untyped-call]
+        request.setHeader(b'Content-Type', CONTENT_TYPES[ext])  # type: ignore[no-untyped-call]
+        if encoding is not None:
+            request.setHeader(b'Content-Encoding', encoding.encode())  # type: ignore[no-untyped-call]
+        request.setHeader(b'Content-Length', b'%d' % len(body))  # type: ignore[no-untyped-call]
+        request.write(body)  # type: ignore[no-untyped-call]
+        finish_request(request)
+        return None
+
     async def _async_render_PUT(self, request: SynapseRequest) -> Tuple[int, JsonDict]:
         # ensure logged in
         requester = await self.api.get_user_by_req(request, allow_guest=False)
         full_id = requester.user.to_string()
         user_id = full_id[1:]  # w/o leading 0;
-        owner_info = await self.api._store.get_profileinfo(
-            UserID.from_string(full_id)
-        )
+        owner_info = await self.profiles.get(full_id)
         payload = parse_json_object_from_request(request)
+        force = parse_boolean(request, "force", default=False)
+        if (request.path or b"").rstrip(b"/").endswith(b"/batch"):
+            return await self._generate_batch(user_id, owner_info, payload, force)
+        return await self._in_threadpool(self._generate, user_id, owner_info, payload, force)
+
+    async def _generate_batch(self, user_id: str, owner_info: ProfileInfo, payload: Dict[str, Any], force: bool) -> Tuple[int, JsonDict]:
+        links = payload.get('links', None)
+        if not isinstance(links, list) or not 0 < len(links) <= MAX_BATCH_SIZE:
+            return 400, {
+                "error": "links must be a list of 1 to {max} share links".format(max=MAX_BATCH_SIZE),
+                "errcode": "INVALID_PARAM",
+            }
+
+        async def _generate_one(link: Any) -> JsonDict:
+            if not isinstance(link, dict):
+                return {"error": "share link must be an object", "errcode": "INVALID_PARAM"}
+            try:
+                code, result = await self._in_threadpool(self._generate, user_id, owner_info, link, force)
+            except Exception as e:
+                logger.warning("Failed to generate share link: {e}".format(e=e))
+                return {"error": "invalid share link: {e}".format(e=e), "errcode": "INVALID_PARAM"}
+            return result
+
+        # the results come back in the order of the links given
+        return 200, {"links": await yieldable_gather_results(_generate_one, links)}
+
+    def _generate(self, user_id: str, owner_info: ProfileInfo, payload: Dict[str, Any], force: bool) -> Tuple[int, JsonDict]:
         uri_type = payload.get('type', None)
         if uri_type == "ref":
-            return self._gen_forRefObject(user_id, owner_info, payload)
+            return self._gen_forRefObject(user_id, owner_info, payload, force)
         elif uri_type == "spaceObject":
-            return self._gen_spaceObject(user_id, owner_info, payload)
+            return self._gen_spaceObject(user_id, owner_info, payload, force)
         elif uri_type == "superInvite":
-            return self._gen_superInvite(user_id, owner_info, payload)
+            return self._gen_superInvite(user_id, owner_info, payload, force)
         elif uri_type == "roomId":
-            return self._gen_roomId(user_id, owner_info, payload)
+            return self._gen_roomId(user_id, owner_info, payload, force)
         elif uri_type == "roomAlias":
-            return self._gen_roomAlias(user_id, owner_info, payload)
+            return self._gen_roomAlias(user_id, owner_info, payload, force)
         elif uri_type == "userId":
-            return self._gen_userId(user_id, owner_info, payload)
+            return self._gen_userId(user_id, owner_info, payload, force)
         else:
             return 403, {
                 "error": "unsupported object type='{uri_type}' ".format(uri_type=uri_type),
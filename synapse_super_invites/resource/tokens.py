@@ -1,24 +1,57 @@
-from typing import Any
-
-from sqlalchemy import func, select
-from synapse.http.servlet import parse_json_object_from_request, parse_string
+from typing import Dict
+
+from sqlalchemy import and_, delete, func, or_, select
+from sqlalchemy.orm import Session, selectinload
+from synapse.http.servlet import (
+    parse_integer,
+    parse_json_object_from_request,
+    parse_string,
+)
 from synapse.http.site import SynapseRequest
+from synapse.module_api import ModuleApi
 from synapse.types import JsonDict, Tuple  # type: ignore[attr-defined]
 
-from synapse_super_invites.model import Room, Token
+from synapse_super_invites.config import SynapseSuperInvitesConfig
+from synapse_super_invites.database import AnyDatabase
+from synapse_super_invites.model import Accepted, Token, token_rooms
+from synapse_super_invites.registration_tokens import RegistrationTokens
+from synapse_super_invites.token_cache import TokenCache
+
+from .base import (
+    TOKEN_FIELDS,
+    SuperInviteResourceBase,
+    add_token_rooms,
+    can_edit_token,
+    serialize_token,
+    token_query,
+    upsert_rooms,
+)
 
-from .base import SuperInviteResourceBase, can_edit_token, serialize_token, token_query
+DEFAULT_LIST_LIMIT = 100
+MAX_LIST_LIMIT = 1000
 
 
 class TokensResource(SuperInviteResourceBase):
+    def __init__(
+        self,
+        config: SynapseSuperInvitesConfig,
+        api: ModuleApi,
+        db: AnyDatabase,
+        tokens: TokenCache,
+        registration_tokens: RegistrationTokens,
+    ):
+        super().__init__(config, api, db, tokens)
+        self.registration_tokens = registration_tokens
+
     async def _async_render_DELETE(
         self, request: SynapseRequest
     ) -> Tuple[int, JsonDict]:
         requester = await self.api.get_user_by_req(request, allow_guest=False)
 
         token_id = parse_string(request, "token", required=True)
-        # query for a specific token
-        with self.db.begin() as session:
+
+        def _delete_token(session: Session) -> Tuple[int, JsonDict]:
+            # query for a specific token
             token = session.scalar(token_query(token_id))
             if not token:
                 return 404, {"error": "Token not found", "errcode": "NOT_FOUND"}
@@ -27,8 +60,12 @@ class TokensResource(SuperInviteResourceBase):
 
             token.deleted_at = func.now()
             session.flush()
+            return 200, {}
 
-        return 200, {}
+        code, response = await self.run_db(_delete_token)
+        if code == 200:
+            await self.tokens.invalidate(token_id)
+        return code, response
 
     async def _async_render_GET(self, request: SynapseRequest) -> Tuple[int, JsonDict]:
         requester = await self.api.get_user_by_req(request, allow_guest=False)
@@ -36,29 +73,94 @@ class TokensResource(SuperInviteResourceBase):
         token_id = parse_string(request, "token")
         # query for a specific token
         if token_id:
-            token_data = None
-            with self.db.begin() as session:
+
+            def _load_token(session: Session) -> Tuple[int, JsonDict]:
                 token = session.scalar(token_query(token_id))
                 if not token:
                     return 404, {"error": "Token not found", "errcode": "NOT_FOUND"}
                 if not can_edit_token(token, requester):
                     return 403, {"error": "Permission denied", "errcode": ""}
 
-                token_data = serialize_token(token)
-
-            return 200, {"token": token_data}
+                return 200, {"token": serialize_token(token)}
+
+            return await self.run_db(_load_token)
+
+        # by default, we list all tokens, a page at a time
+        from_token = parse_string(request, "from")
+        limit = parse_integer(request, "limit", default=DEFAULT_LIST_LIMIT)
+        if limit < 1:
+            return 400, {"error": "limit must be positive", "errcode": "INVALID_PARAM"}
+        limit = min(limit, MAX_LIST_LIMIT)
+        fields_param = parse_string(request, "fields")
+        fields: Tuple[str, ...] = TOKEN_FIELDS
+        if fields_param is not None:
+            fields = tuple(f for f in fields_param.split(",") if f in TOKEN_FIELDS)
+
+        def _list_tokens(session: Session) -> Tuple[int, JsonDict]:
+            query = select(Token).where(
+                Token.owner == str(requester.user),
+                Token.deleted_at == None,  # noqa: E711
+            )
+            if from_token:
+                # keyset pagination: continue right after the last token seen,
+                # which may have been deleted since
+                last = (Token.token == from_token, Token.owner == str(requester.user))
+                if session.scalar(select(Token.token).where(*last)) is None:
+                    # would look like the end of the list otherwise
+                    return 400, {
+                        "error": "Unknown from token",
+                        "errcode": "INVALID_PARAM",
+                    }
+                last_created_at = (
+                    select(Token.created_at).where(*last).scalar_subquery()
+                )
+                query = query.where(
+                    or_(
+                        Token.created_at > last_created_at,
+                        and_(
+                            Token.created_at == last_created_at,
+                            Token.token > from_token,
+                        ),
+                    )
+                )
+            if "rooms" in fields:
+                query = query.options(selectinload(Token.rooms))
 
-        # by default, we list all tokens
-        tokens = []
-        with self.db.begin() as session:
-            for token in session.scalars(
-                select(Token).where(
-                    Token.owner == str(requester.user),
-                    Token.deleted_at == None,  # noqa: E711
+            # fetch one more to know whether there is another page
+            page = list(
+                session.scalars(
+                    query.order_by(Token.created_at, Token.token).limit(limit + 1)
                 )
-            ).all():
-                tokens.append(serialize_token(token))
-        return 200, {"tokens": tokens}
+            )
+            next_batch = None
+            if len(page) > limit:
+                page = page[:limit]
+                next_batch = page[-1].token
+
+            accepted_counts: Dict[str, int] = {}
+            if "accepted_count" in fields and page:
+                # count the acceptances of the whole page in one go, rather
+                # than loading them per token
+                accepted_counts = dict(
+                    session.execute(
+                        select(Accepted.token_id, func.count(Accepted.id))
+                        .where(Accepted.token_id.in_([t.token for t in page]))
+                        .group_by(Accepted.token_id)
+                    )
+                    .tuples()
+                    .all()
+                )
+
+            tokens = [
+                serialize_token(token, accepted_counts.get(token.token, 0), fields)
+                for token in page
+            ]
+            response: JsonDict = {"tokens": tokens}
+            if next_batch is not None:
+                response["next_batch"] = next_batch
+            return 200, response
+
+        return await self.run_db(_list_tokens)
 
     async def _async_render_POST(self, request: SynapseRequest) -> Tuple[int, JsonDict]:
         requester = await self.api.get_user_by_req(request, allow_guest=False)
@@ -67,13 +169,11 @@ class TokensResource(SuperInviteResourceBase):
         create_dm = payload.get("create_dm", False)
         as_registration_token = payload.get("as_registration_token", True)
 
-        token_data = None
-        with self.db.begin() as session:
-            rooms = [
-                session.merge(Room(nameOrAlias=key)) for key in payload.get("rooms", [])
-            ]
+        def _save_token(session: Session) -> Tuple[int, JsonDict]:
+            room_ids = list(dict.fromkeys(payload.get("rooms", [])))
 
             token = None
+            accepted_count = 0
             if token_id:
                 token = session.scalar(select(Token).where(Token.token == token_id))
 
@@ -82,40 +182,45 @@ class TokensResource(SuperInviteResourceBase):
                     if not can_edit_token(token, requester):
                         return 403, {"error": "Permission denied", "errcode": ""}
 
-                    # token.rooms = rooms
                     token.create_dm = create_dm
-                    token.rooms = rooms
+                    # only touch the associations that changed
+                    session.execute(
+                        delete(token_rooms).where(
+                            token_rooms.c.token == token.token,
+                            token_rooms.c.room.not_in(room_ids),
+                        )
+                    )
+                    accepted_count = (
+                        session.scalar(
+                            select(func.count(Accepted.id)).where(
+                                Accepted.token_id == token.token
+                            )
+                        )
+                        or 0
+                    )
 
             if not token:
                 token = Token(
                     token=token_id,
                     create_dm=create_dm,
                     owner=str(requester.user),
-                    rooms=rooms,
                 )
                 session.add(token)
 
+            upsert_rooms(session, room_ids)
             session.flush()
+            add_token_rooms(session, token.token, room_ids)
 
-            token_data = serialize_token(token)
-
-        registration_token: dict[Any, Any] = {}
-        if as_registration_token:
-            if not self.config.generate_registration_token:
-                registration_token["valid"] = False
-                registration_token["reason"] = "NOT_ENABLED"
-            else:
-                token_id = token_data["token"]
-                # FIXME: it'd be great if we didn't have to resort to using internal args...
-                if not (await self.api._store.registration_token_is_valid(token_id)):
-                    await self.api._store.create_registration_token(
-                        token=token_id, uses_allowed=None, expiry_time=None
-                    )
-                    registration_token["valid"] = True
-                else:
-                    registration_token["valid"] = True
-        else:
-            registration_token["valid"] = False
-            registration_token["reason"] = "NOT_REQUESTED"
+            data = serialize_token(token, accepted_count, fields=("accepted_count",))
+            data["rooms"] = room_ids
+            return 200, data
+
+        code, token_data = await self.run_db(_save_token)
+        if code != 200:
+            return code, token_data
+        await self.tokens.invalidate(token_data["token"])
 
+        registration_token = await self.registration_tokens.provide(
+            [token_data["token"]], as_registration_token
+        )
         return 200, {"token": token_data, "registration_token": registration_token}
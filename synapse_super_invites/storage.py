@@ -0,0 +1,359 @@
+import hashlib
+import mimetypes
+import os
+import re
+import time
+from abc import ABC, abstractmethod
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import attr
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from synapse.config import ConfigError
+from synapse.util.caches.lrucache import LruCache
+
+from .config import ShareLinkGeneratorConfig
+from .database import AnyDatabase
+from .files import write_atomic, write_atomic_batch
+from .model import ShareFile
+
+try:
+    import boto3  # type: ignore[import-untyped]
+    from botocore.exceptions import ClientError  # type: ignore[import-untyped]
+except ImportError:
+    boto3 = None
+
+mimetypes.add_type("image/webp", ".webp")
+
+# all our files start with the hash of their share link
+SHARE_FILE = re.compile(r"^([0-9a-f]{40})[._]")
+SHARD_DIR = re.compile(r"^[0-9a-f]{2}$")
+# temporary files of writes that never finished
+STALE_TEMP_SECONDS = 60 * 60
+# uses of a file are recorded at most this often, and for this many files
+TOUCH_INTERVAL_SECONDS = 60 * 60
+TOUCHED_FILES = 10000
+
+
+@attr.s(frozen=True, slots=True, auto_attribs=True)
+class StoredFile:
+    # changes whenever the data does, used for the ETag
+    version: str
+    data: bytes
+
+
+def content_version(data: bytes) -> str:
+    return hashlib.sha1(data).hexdigest()
+
+
+class ShareStorage(ABC):
+    """Where the share link pages, images and links are kept, by file name.
+
+    All methods block, they are only ever called on the share link thread
+    pool.
+    """
+
+    @abstractmethod
+    def write(self, files: Dict[str, bytes]) -> None:
+        """Store all `files`, file name to data, in the given order."""
+
+    @abstractmethod
+    def version(self, name: str) -> Optional[str]:
+        """The current version of `name`, None if it isn't stored."""
+
+    @abstractmethod
+    def read(self, name: str) -> Optional[StoredFile]:
+        pass
+
+
+@attr.s(slots=True, auto_attribs=True)
+class _SweptLink:
+    size: int = 0
+    last_used: float = 0
+    paths: List[str] = attr.Factory(list)
+
+
+class FileStorage(ShareStorage):
+    """Files in a local directory, e.g. for a web server to serve them.
+
+    With a `shard_depth`, files go into sub directories named after the first
+    characters of their hash, e.g. `ab/cd/abcd….html` for a depth of two.
+    Files from before sharding was turned on are still found.
+    """
+
+    def __init__(self, path: str, shard_depth: int = 0):
+        self.path = path
+        self.shard_depth = shard_depth
+        # name -> when its use was last recorded
+        self._touched: LruCache[str, float] = LruCache(
+            TOUCHED_FILES,
+            "super_invites_share_storage_touched",
+            apply_cache_factor_from_config=False,
+        )
+
+    def _path(self, name: str) -> str:
+        shards = [name[2 * i : 2 * i + 2] for i in range(self.shard_depth)]
+        return os.path.join(self.path, *shards, name)
+
+    def _paths(self, name: str) -> List[str]:
+        paths = [self._path(name)]
+        if self.shard_depth:
+            paths.append(os.path.join(self.path, name))
+        return paths
+
+    def write(self, files: Dict[str, bytes]) -> None:
+        paths = {self._path(name): data for name, data in files.items()}
+        if self.shard_depth:
+            for directory in {os.path.dirname(path) for path in paths}:
+                os.makedirs(directory, exist_ok=True)
+        if len(paths) == 1:
+            write_atomic(*next(iter(paths.items())))
+        else:
+            write_atomic_batch(paths)
+
+    @staticmethod
+    def _version(st: os.stat_result) -> str:
+        # files are replaced by renaming, so this changes with the content
+        return "{m:x}-{s:x}".format(m=st.st_mtime_ns, s=st.st_size)
+
+    def version(self, name: str) -> Optional[str]:
+        for path in self._paths(name):
+            try:
+                return self._version(os.stat(path))
+            except FileNotFoundError:
+                pass
+        return None
+
+    def read(self, name: str) -> Optional[StoredFile]:
+        for path in self._paths(name):
+            try:
+                f = open(path, mode="rb")
+            except FileNotFoundError:
+                continue
+            with f:
+                return StoredFile(self._version(os.fstat(f.fileno())), f.read())
+        return None
+
+    def touch(self, name: str) -> None:
+        """Record that `name` is still in use, for `sweep`."""
+        now = time.time()
+        touched = self._touched.get(name)
+        if touched is not None and now - touched < TOUCH_INTERVAL_SECONDS:
+            return
+        for path in self._paths(name):
+            try:
+                fd = os.open(path, os.O_RDONLY)
+            except FileNotFoundError:
+                continue
+            try:
+                # only the atime, the mtime is part of the version. Not left
+                # to the kernel, which may update it rarely or never
+                os.utime(fd, ns=(time.time_ns(), os.fstat(fd).st_mtime_ns))
+            finally:
+                os.close(fd)
+            self._touched.set(name, now)
+            return
+
+    def _scan(self, directory: str) -> Iterator[os.DirEntry[str]]:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    if SHARD_DIR.match(entry.name):
+                        yield from self._scan(entry.path)
+                elif entry.is_file(follow_symlinks=False):
+                    yield entry
+
+    @staticmethod
+    def _remove(paths: List[str]) -> int:
+        removed = 0
+        for path in paths:
+            try:
+                os.unlink(path)
+                removed += 1
+            except FileNotFoundError:
+                # e.g. by another worker sharing the directory
+                pass
+        return removed
+
+    def sweep(self, max_age: Optional[float], max_bytes: Optional[int]) -> int:
+        """Remove all files of the share links not used for `max_age`
+        seconds, then of those used least recently until all of them take up
+        no more than `max_bytes`. Returns the number of files removed."""
+        now = time.time()
+        removed = 0
+        links: Dict[str, _SweptLink] = {}
+        for entry in self._scan(self.path):
+            try:
+                st = entry.stat(follow_symlinks=False)
+            except FileNotFoundError:
+                continue
+            if entry.name.startswith("."):
+                if now - st.st_mtime > STALE_TEMP_SECONDS:
+                    removed += self._remove([entry.path])
+                continue
+            match = SHARE_FILE.match(entry.name)
+            if match is None:
+                # not ours
+                continue
+            # all files of a link go together, so no page is left without its
+            # images or compressed variants. Their uses are recorded in the
+            # atime by `touch`
+            link = links.setdefault(match.group(1), _SweptLink())
+            link.size += st.st_size
+            link.last_used = max(link.last_used, st.st_mtime, st.st_atime)
+            link.paths.append(entry.path)
+
+        total = sum(link.size for link in links.values())
+        for link in sorted(links.values(), key=lambda link: link.last_used):
+            too_old = max_age is not None and now - link.last_used > max_age
+            too_big = max_bytes is not None and total > max_bytes
+            if not (too_old or too_big):
+                # all others have been used more recently
+                break
+            removed += self._remove(link.paths)
+            total -= link.size
+        return removed
+
+
+def _write_share_files(session: Session, files: Dict[str, bytes]) -> None:
+    for name, data in files.items():
+        session.merge(ShareFile(name=name, version=content_version(data), data=data))
+    session.flush()
+
+
+def _share_file_version(session: Session, name: str) -> Optional[str]:
+    return session.scalar(select(ShareFile.version).where(ShareFile.name == name))
+
+
+def _read_share_file(session: Session, name: str) -> Optional[StoredFile]:
+    row = session.execute(
+        select(ShareFile.version, ShareFile.data).where(ShareFile.name == name)
+    ).first()
+    if row is None:
+        return None
+    return StoredFile(row.version, row.data)
+
+
+class SqlStorage(ShareStorage):
+    """Files in the module's own database, shared by all workers."""
+
+    def __init__(self, db: AnyDatabase):
+        self.db = db
+
+    def write(self, files: Dict[str, bytes]) -> None:
+        # all of them in one transaction
+        self.db.run_blocking(_write_share_files, files)
+
+    def version(self, name: str) -> Optional[str]:
+        return self.db.run_blocking(_share_file_version, name)
+
+    def read(self, name: str) -> Optional[StoredFile]:
+        return self.db.run_blocking(_read_share_file, name)
+
+
+class S3Storage(ShareStorage):
+    """Files in an S3 compatible bucket, e.g. on AWS or a MinIO server."""
+
+    def __init__(self, config: ShareLinkGeneratorConfig):
+        if boto3 is None:
+            raise ConfigError(
+                "share_link_generator.storage s3 needs boto3, "
+                "install synapse-super-invites[s3]"
+            )
+        self.bucket = config.s3_bucket
+        self.prefix = config.s3_prefix
+        # clients are thread safe, one is enough for the whole pool
+        self.client = boto3.client(
+            "s3",
+            endpoint_url=config.s3_endpoint_url,
+            region_name=config.s3_region,
+            aws_access_key_id=config.s3_access_key_id,
+            aws_secret_access_key=config.s3_secret_access_key,
+        )
+
+    def write(self, files: Dict[str, bytes]) -> None:
+        for name, data in files.items():
+            args = {}
+            content_type, _encoding = mimetypes.guess_type(name)
+            if content_type is not None:
+                args["ContentType"] = content_type
+            self.client.put_object(
+                Bucket=self.bucket, Key=self.prefix + name, Body=data, **args
+            )
+
+    def version(self, name: str) -> Optional[str]:
+        try:
+            head = self.client.head_object(Bucket=self.bucket, Key=self.prefix + name)
+        except ClientError as e:
+            if e.response["Error"]["Code"] in ("404", "NoSuchKey"):
+                return None
+            raise
+        etag: str = head["ETag"]
+        return etag.strip('"')
+
+    def read(self, name: str) -> Optional[StoredFile]:
+        try:
+            obj = self.client.get_object(Bucket=self.bucket, Key=self.prefix + name)
+        except ClientError as e:
+            if e.response["Error"]["Code"] in ("404", "NoSuchKey"):
+                return None
+            raise
+        with obj["Body"] as body:
+            return StoredFile(obj["ETag"].strip('"'), body.read())
+
+
+class CachedStorage(ShareStorage):
+    """Keeps what was read from a remote storage in memory.
+
+    Cached files are trusted for `ttl_ms`, after which they are checked again:
+    changes made through other workers can take that long to show. Our own
+    writes drop the cached files right away.
+    """
+
+    def __init__(self, storage: ShareStorage, max_bytes: int, ttl_ms: int):
+        self.storage = storage
+        self.ttl = ttl_ms / 1000
+        # name -> (when it was read, the file)
+        self._cache: LruCache[str, Tuple[float, StoredFile]] = LruCache(
+            max_bytes,
+            "super_invites_share_storage",
+            size_callback=lambda entry: len(entry[1].data),
+            apply_cache_factor_from_config=False,
+        )
+
+    def write(self, files: Dict[str, bytes]) -> None:
+        self.storage.write(files)
+        for name in files:
+            self._cache.invalidate(name)
+
+    def version(self, name: str) -> Optional[str]:
+        stored = self.read(name)
+        return stored.version if stored is not None else None
+
+    def read(self, name: str) -> Optional[StoredFile]:
+        entry = self._cache.get(name)
+        if entry is not None and time.monotonic() - entry[0] < self.ttl:
+            return entry[1]
+        stored = self.storage.read(name)
+        if stored is not None:
+            self._cache.set(name, (time.monotonic(), stored))
+        return stored
+
+
+def create_share_storage(
+    config: ShareLinkGeneratorConfig, db: AnyDatabase
+) -> ShareStorage:
+    if config.storage == "file":
+        assert config.target_path is not None
+        return FileStorage(config.target_path, config.shard_depth)
+
+    remote: ShareStorage
+    if config.storage == "sql":
+        remote = SqlStorage(db)
+    else:
+        remote = S3Storage(config)
+    if config.storage_cache_bytes <= 0:
+        return remote
+    return CachedStorage(
+        remote, config.storage_cache_bytes, config.storage_cache_ttl_ms
+    )
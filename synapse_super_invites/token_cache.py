@@ -0,0 +1,61 @@
+from typing import Optional, Tuple
+
+import attr
+from sqlalchemy import select
+from sqlalchemy.orm import Session, selectinload
+from synapse.module_api import ModuleApi
+from synapse.util.caches.descriptors import cached
+
+from .database import AnyDatabase
+from .model import Token
+
+
+@attr.s(frozen=True, slots=True, auto_attribs=True)
+class TokenSnapshot:
+    token: str
+    owner: str
+    create_dm: bool
+    rooms: Tuple[str, ...]
+    deleted: bool
+
+
+def _load_snapshot(session: Session, token_id: str) -> Optional[TokenSnapshot]:
+    token = session.scalar(
+        select(Token).options(selectinload(Token.rooms)).where(Token.token == token_id)
+    )
+    if token is None:
+        return None
+    return TokenSnapshot(
+        token=token.token,
+        owner=token.owner,
+        create_dm=token.create_dm,
+        rooms=tuple(room.nameOrAlias for room in token.rooms),
+        deleted=token.deleted_at is not None,
+    )
+
+
+class TokenCache:
+    """Read-through cache of what info and redeem need to know about a token.
+
+    Tokens are read far more often than they are changed, so the snapshots
+    live in one of synapse's LRU caches: sized and expired through synapse's
+    `caches` config like any of its own, and invalidated across workers
+    through replication whenever a token is changed.
+    """
+
+    def __init__(self, api: ModuleApi, db: AnyDatabase):
+        self.api = api
+        self.db = db
+        api.register_cached_function(self._get_token)
+
+    # named for synapse's `caches.per_cache_factors`
+    @cached(name="super_invites_get_token")
+    async def _get_token(self, token_id: str) -> Optional[TokenSnapshot]:
+        return await self.db.run(_load_snapshot, token_id)
+
+    async def get_token(self, token_id: str) -> Optional[TokenSnapshot]:
+        # `@cached` methods only type check with synapse's mypy plugin
+        return await self._get_token(token_id)  # type: ignore[arg-type, call-arg, misc]
+
+    async def invalidate(self, token_id: str) -> None:
+        await self.api.invalidate_cache(self._get_token, (token_id,))
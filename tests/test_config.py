@@ -30,3 +30,44 @@ class ConfigParsingTests(TestCase):
             }
         )
         self.assertEqual(config.generate_registration_token, False)
+
+    def test_pool_config(self) -> None:
+        config = SynapseSuperInvites.parse_config(
+            {
+                "sql_url": "postgresql://synapse@localhost/super_invites",
+                "pool_size": 20,
+                "max_overflow": 5,
+                "pool_pre_ping": True,
+                "statement_timeout": 5000,
+            }
+        )
+        self.assertEqual(config.pool_size, 20)
+        self.assertEqual(config.max_overflow, 5)
+        self.assertIsNone(config.pool_timeout)
+        self.assertTrue(config.pool_pre_ping)
+        self.assertEqual(config.statement_timeout, 5000)
+
+    def test_lazy_share_links_need_serve(self) -> None:
+        with self.assertRaises(ConfigError):
+            SynapseSuperInvites.parse_config(
+                {
+                    "sql_url": "sqlite:///",
+                    "share_link_generator": {
+                        "url_prefix": "https://preview.example.com/",
+                        "target_path": "/tmp",
+                        "lazy": True,
+                    },
+                }
+            )
+
+    def test_sql_share_link_storage_needs_serve(self) -> None:
+        with self.assertRaises(ConfigError):
+            SynapseSuperInvites.parse_config(
+                {
+                    "sql_url": "sqlite:///",
+                    "share_link_generator": {
+                        "url_prefix": "https://preview.example.com/",
+                        "storage": "sql",
+                    },
+                }
+            )
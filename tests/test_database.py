@@ -0,0 +1,130 @@
+import threading
+from tempfile import TemporaryDirectory
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session, sessionmaker
+from synapse.logging.context import LoggingContext
+from twisted.internet import defer, reactor
+from twisted.trial.unittest import TestCase
+
+from synapse_super_invites import SynapseSuperInvites
+from synapse_super_invites.config import run_alembic
+from synapse_super_invites.database import (
+    AsyncDatabase,
+    Database,
+    create_async_db_engine,
+    create_db_engine,
+)
+from synapse_super_invites.jobs import reserve_redemption
+from synapse_super_invites.model import Token
+
+try:
+    import aiosqlite
+except ImportError:
+    aiosqlite = None  # type: ignore[assignment]
+
+
+class DatabaseTests(TestCase):
+    def setUp(self) -> None:
+        self.tmp_dir = TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.config = SynapseSuperInvites.parse_config(
+            {"sql_url": "sqlite:///{d}/db.sqlite".format(d=self.tmp_dir.name)}
+        )
+        engine = create_db_engine(self.config)
+        run_alembic(engine)
+        self.db = Database(reactor, sessionmaker(engine), 2)  # type: ignore[arg-type]
+        self.addCleanup(self.db._stop)
+
+    @defer.inlineCallbacks
+    def test_runs_off_the_reactor_thread(self):  # type: ignore[no-untyped-def]
+        reactor_thread = threading.get_ident()
+
+        def _create(session: Session) -> int:
+            session.add(Token(token="abc", owner="@meeko:test", create_dm=False))
+            return threading.get_ident()
+
+        def _load(session: Session) -> str:
+            token = session.scalar(select(Token).where(Token.token == "abc"))
+            assert token is not None
+            return token.owner
+
+        with LoggingContext("test"):
+            db_thread = yield defer.ensureDeferred(self.db.run(_create))
+            owner = yield defer.ensureDeferred(self.db.run(_load))
+
+        self.assertNotEqual(db_thread, reactor_thread)
+        self.assertEqual(owner, "@meeko:test")
+
+    @defer.inlineCallbacks
+    def test_rolls_back_on_error(self):  # type: ignore[no-untyped-def]
+        def _create_and_fail(session: Session) -> None:
+            session.add(Token(token="abc", owner="@meeko:test", create_dm=False))
+            session.flush()
+            raise ValueError("nope")
+
+        def _count(session: Session) -> int:
+            return len(session.scalars(select(Token)).all())
+
+        with LoggingContext("test"):
+            yield self.assertFailure(
+                defer.ensureDeferred(self.db.run(_create_and_fail)), ValueError
+            )
+            count = yield defer.ensureDeferred(self.db.run(_count))
+
+        self.assertEqual(count, 0)
+
+    def test_redemption_reserved_once(self) -> None:
+        def _create(session: Session) -> None:
+            session.add(Token(token="abc", owner="@meeko:test", create_dm=False))
+
+        self.db.run_blocking(_create)
+        self.assertTrue(self.db.run_blocking(reserve_redemption, "abc", "@flit:test"))
+        self.assertFalse(self.db.run_blocking(reserve_redemption, "abc", "@flit:test"))
+        self.assertTrue(self.db.run_blocking(reserve_redemption, "abc", "@lolo:test"))
+
+
+class AsyncDatabaseTests(TestCase):
+    if aiosqlite is None:
+        skip = "aiosqlite is not installed"
+
+    def setUp(self) -> None:
+        self.tmp_dir = TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.config = SynapseSuperInvites.parse_config(
+            {
+                "sql_url": "sqlite+aiosqlite:///{d}/db.sqlite".format(
+                    d=self.tmp_dir.name
+                ),
+                "sql_async": True,
+            }
+        )
+        self.db = AsyncDatabase(reactor, create_async_db_engine(self.config))  # type: ignore[arg-type]
+        self.addCleanup(self.db._stop)
+        self.db.migrate()
+
+    @defer.inlineCallbacks
+    def test_create_and_load(self):  # type: ignore[no-untyped-def]
+        def _create(session: Session) -> None:
+            session.add(Token(token="abc", owner="@meeko:test", create_dm=True))
+
+        def _load(session: Session) -> bool:
+            token = session.scalar(select(Token).where(Token.token == "abc"))
+            assert token is not None
+            return token.create_dm
+
+        with LoggingContext("test"):
+            yield defer.ensureDeferred(self.db.run(_create))
+            create_dm = yield defer.ensureDeferred(self.db.run(_load))
+
+        self.assertTrue(create_dm)
+
+    @defer.inlineCallbacks
+    def test_errors_are_raised(self):  # type: ignore[no-untyped-def]
+        def _fail(session: Session) -> None:
+            raise ValueError("nope")
+
+        with LoggingContext("test"):
+            yield self.assertFailure(
+                defer.ensureDeferred(self.db.run(_fail)), ValueError
+            )
@@ -1,17 +1,27 @@
+from datetime import datetime, timedelta, timezone
 from typing import Any
 
+from matrix_synapse_testutils.server import (  # type: ignore[import-untyped]
+    ThreadPool,
+)
 from matrix_synapse_testutils.unittest import (  # type: ignore[import-untyped]
     HomeserverTestCase,
     override_config,
 )
+from sqlalchemy import select, update
+from sqlalchemy.orm import Session
 from synapse.rest import admin
 from synapse.rest.client import login, profile, register, room, sync
 from synapse.server import HomeServer
-from synapse.types import Dict  # type: ignore[attr-defined]
+from synapse.types import Dict, List  # type: ignore[attr-defined]
 from synapse.util import Clock
 from twisted.test.proto_helpers import MemoryReactor
 from twisted.web.resource import Resource
 
+from synapse_super_invites.jobs import fail_job
+from synapse_super_invites.model import RedeemJob
+from synapse_super_invites.resource.bulk_tokens import MAX_BULK_TOKENS
+
 from .test_config import DEFAULT_CONFIG as DEFAULT_MODULE_CFG
 
 DEFAULT_CONFIG = {
@@ -41,6 +51,13 @@ class SuperInviteHomeserverTestCase(HomeserverTestCase):  # type: ignore[misc]
         self.event_creation_handler = hs.get_event_creation_handler()
         self.sync_handler = hs.get_sync_handler()
         self.auth_handler = hs.get_auth_handler()
+        # like synapse's own database, run the module's db work synchronously
+        for resource in hs._module_web_resources.values():
+            db = getattr(resource, "db", None)
+            if db is not None:
+                db._threadpool = ThreadPool(reactor)
+            if hasattr(resource, "_threadpool"):
+                resource._threadpool = ThreadPool(reactor)
 
     def create_resource_dict(self) -> Dict[str, Resource]:
         d: Dict[str, Resource] = super().create_resource_dict()
@@ -221,6 +238,15 @@ class SimpleInviteTests(SuperInviteHomeserverTestCase):
         token_data = channel.json_body["token"]
         self.assertEquals(token_data["accepted_count"], 1)
 
+        # and in the listing, too
+        channel = self.make_request(
+            "GET", "/_synapse/client/super_invites/tokens", access_token=m_access_token
+        )
+        self.assertEqual(channel.code, 200, msg=channel.result)
+        self.assertEqual(len(channel.json_body["tokens"]), 1)
+        self.assertEquals(channel.json_body["tokens"][0]["accepted_count"], 1)
+        self.assertCountEqual(channel.json_body["tokens"][0]["rooms"], rooms_to_invite)
+
         channel = self.make_request(
             "GET",
             "/_synapse/client/super_invites/info?token={token}".format(token=token),
@@ -880,3 +906,625 @@ class SimpleInviteTests(SuperInviteHomeserverTestCase):
             access_token=m_access_token,
         )
         self.assertEqual(channel.code, 400, msg=channel.result)
+
+    @override_config(DEFAULT_CONFIG)  # type: ignore[misc]
+    def test_list_pagination(self) -> None:
+        m_id = self.register_user("meeko", "password")
+        m_access_token = self.login("meeko", "password")
+        room = self.create_room(m_id)
+
+        created = []
+        for _ in range(5):
+            channel = self.make_request(
+                "POST",
+                "/_synapse/client/super_invites/tokens",
+                access_token=m_access_token,
+                content={"rooms": [room]},
+            )
+            self.assertEqual(channel.code, 200, msg=channel.result)
+            created.append(channel.json_body["token"]["token"])
+
+        # page through them two at a time
+        listed: List[str] = []
+        next_batch = None
+        pages = 0
+        while True:
+            url = "/_synapse/client/super_invites/tokens?limit=2"
+            if next_batch:
+                url += "&from={f}".format(f=next_batch)
+            channel = self.make_request("GET", url, access_token=m_access_token)
+            self.assertEqual(channel.code, 200, msg=channel.result)
+            self.assertLessEqual(len(channel.json_body["tokens"]), 2)
+            listed.extend(t["token"] for t in channel.json_body["tokens"])
+            pages += 1
+            next_batch = channel.json_body.get("next_batch")
+            if not next_batch:
+                break
+
+        self.assertEqual(pages, 3)
+        self.assertEqual(len(listed), 5)
+        self.assertCountEqual(listed, created)
+
+        # only ask for the counts
+        channel = self.make_request(
+            "GET",
+            "/_synapse/client/super_invites/tokens?fields=accepted_count",
+            access_token=m_access_token,
+        )
+        self.assertEqual(channel.code, 200, msg=channel.result)
+        self.assertEqual(len(channel.json_body["tokens"]), 5)
+        self.assertNotIn("next_batch", channel.json_body)
+        for token_data in channel.json_body["tokens"]:
+            self.assertEqual(token_data["accepted_count"], 0)
+            self.assertNotIn("rooms", token_data)
+
+        # no optional fields at all
+        channel = self.make_request(
+            "GET",
+            "/_synapse/client/super_invites/tokens?fields=",
+            access_token=m_access_token,
+        )
+        self.assertEqual(channel.code, 200, msg=channel.result)
+        self.assertCountEqual(
+            channel.json_body["tokens"][0].keys(), ["token", "create_dm"]
+        )
+
+        channel = self.make_request(
+            "GET",
+            "/_synapse/client/super_invites/tokens?limit=0",
+            access_token=m_access_token,
+        )
+        self.assertEqual(channel.code, 400, msg=channel.result)
+
+        # not a token of ours, rather than looking like the end of the list
+        channel = self.make_request(
+            "GET",
+            "/_synapse/client/super_invites/tokens?from=unknown",
+            access_token=m_access_token,
+        )
+        self.assertEqual(channel.code, 400, msg=channel.result)
+        self.assertEqual(channel.json_body["errcode"], "INVALID_PARAM")
+
+    @override_config(
+        {
+            "modules": [
+                {
+                    "module": "synapse_super_invites.SynapseSuperInvites",
+                    "config": {"sql_url": "sqlite:///", "redeem_concurrency": 3},
+                }
+            ],
+        }
+    )  # type: ignore[misc]
+    def test_redeem_many_rooms(self) -> None:
+        m_id = self.register_user("meeko", "password")
+        m_access_token = self.login("meeko", "password")
+
+        rooms_to_invite = [self.create_room(m_id) for _ in range(8)]
+        channel = self.make_request(
+            "POST",
+            "/_synapse/client/super_invites/tokens",
+            access_token=m_access_token,
+            content={"rooms": rooms_to_invite, "create_dm": True},
+        )
+        self.assertEqual(channel.code, 200, msg=channel.result)
+        token = channel.json_body["token"]["token"]
+
+        # one of them is broken
+        self.leave_room(m_id, rooms_to_invite[3])
+        broken_room = rooms_to_invite.pop(3)
+
+        _f_id = self.register_user("flit", "flit")
+        f_access_token = self.login("flit", "flit")
+
+        channel = self.make_request(
+            "POST",
+            "/_synapse/client/super_invites/redeem?token={token}".format(token=token),
+            access_token=f_access_token,
+        )
+        self.assertEqual(channel.code, 200, msg=channel.result)
+        # all working rooms, followed by the DM
+        self.assertCountEqual(channel.json_body["rooms"][:-1], rooms_to_invite)
+        dm_room = channel.json_body["rooms"][-1]
+        self.assertNotIn(dm_room, rooms_to_invite + [broken_room])
+
+        channel = self.make_request(
+            "GET", "/_matrix/client/v3/sync", access_token=f_access_token
+        )
+        self.assertEqual(channel.code, 200, msg=channel.result)
+        self.assertCountEqual(
+            channel.json_body["rooms"]["join"].keys(), rooms_to_invite + [dm_room]
+        )
+
+    @override_config(DEFAULT_CONFIG)  # type: ignore[misc]
+    def test_redeem_in_background(self) -> None:
+        m_id = self.register_user("meeko", "password")
+        m_access_token = self.login("meeko", "password")
+
+        rooms_to_invite = [self.create_room(m_id) for _ in range(3)]
+        channel = self.make_request(
+            "POST",
+            "/_synapse/client/super_invites/tokens",
+            access_token=m_access_token,
+            content={"rooms": rooms_to_invite, "create_dm": True},
+        )
+        self.assertEqual(channel.code, 200, msg=channel.result)
+        token = channel.json_body["token"]["token"]
+
+        # one of them is broken
+        self.leave_room(m_id, rooms_to_invite[1])
+        broken_room = rooms_to_invite.pop(1)
+
+        _f_id = self.register_user("flit", "flit")
+        f_access_token = self.login("flit", "flit")
+
+        channel = self.make_request(
+            "POST",
+            "/_synapse/client/super_invites/redeem?token={token}&background=true".format(
+                token=token
+            ),
+            access_token=f_access_token,
+        )
+        self.assertEqual(channel.code, 202, msg=channel.result)
+        self.assertEqual(channel.json_body["status"], "pending")
+        job_id = channel.json_body["job_id"]
+
+        # asking again gives us the same job
+        channel = self.make_request(
+            "POST",
+            "/_synapse/client/super_invites/redeem?token={token}&background=true".format(
+                token=token
+            ),
+            access_token=f_access_token,
+        )
+        self.assertEqual(channel.code, 202, msg=channel.result)
+        self.assertEqual(channel.json_body["job_id"], job_id)
+
+        # a direct redeem meanwhile doesn't do the work a second time
+        channel = self.make_request(
+            "POST",
+            "/_synapse/client/super_invites/redeem?token={token}".format(token=token),
+            access_token=f_access_token,
+        )
+        self.assertEqual(channel.code, 400, msg=channel.result)
+        self.assertEqual(channel.json_body["errcode"], "ALREADY_REDEEMED")
+
+        # no one else can see it
+        channel = self.make_request(
+            "GET",
+            "/_synapse/client/super_invites/redeem_jobs?job={job}".format(job=job_id),
+            access_token=m_access_token,
+        )
+        self.assertEqual(channel.code, 404, msg=channel.result)
+
+        # let the worker pick it up
+        self.reactor.advance(2)
+
+        channel = self.make_request(
+            "GET",
+            "/_synapse/client/super_invites/redeem_jobs?job={job}".format(job=job_id),
+            access_token=f_access_token,
+        )
+        self.assertEqual(channel.code, 200, msg=channel.result)
+        self.assertEqual(channel.json_body["status"], "done")
+        progress = {
+            room["room_id"]: room["status"] for room in channel.json_body["progress"]
+        }
+        self.assertEqual(progress[broken_room], "failed")
+        self.assertEqual(progress[rooms_to_invite[0]], "joined")
+        self.assertEqual(progress[rooms_to_invite[1]], "joined")
+        dm_room = channel.json_body["rooms"][-1]
+        self.assertCountEqual(channel.json_body["rooms"][:-1], rooms_to_invite)
+
+        channel = self.make_request(
+            "GET", "/_matrix/client/v3/sync", access_token=f_access_token
+        )
+        self.assertEqual(channel.code, 200, msg=channel.result)
+        self.assertCountEqual(
+            channel.json_body["rooms"]["join"].keys(), rooms_to_invite + [dm_room]
+        )
+
+        # and it counts as redeemed
+        channel = self.make_request(
+            "GET",
+            "/_synapse/client/super_invites/info?token={token}".format(token=token),
+            access_token=f_access_token,
+        )
+        self.assertEqual(channel.code, 200, msg=channel.result)
+        self.assertEqual(channel.json_body["has_redeemed"], True)
+
+    @override_config(DEFAULT_CONFIG)  # type: ignore[misc]
+    def test_redeem_with_idempotency_key(self) -> None:
+        m_id = self.register_user("meeko", "password")
+        m_access_token = self.login("meeko", "password")
+
+        rooms_to_invite = [self.create_room(m_id) for _ in range(3)]
+        tokens = []
+        for _ in range(2):
+            channel = self.make_request(
+                "POST",
+                "/_synapse/client/super_invites/tokens",
+                access_token=m_access_token,
+                content={"rooms": rooms_to_invite, "create_dm": True},
+            )
+            self.assertEqual(channel.code, 200, msg=channel.result)
+            tokens.append(channel.json_body["token"]["token"])
+
+        _f_id = self.register_user("flit", "flit")
+        f_access_token = self.login("flit", "flit")
+
+        redeem_url = (
+            "/_synapse/client/super_invites/redeem?token={token}&idempotency_key={key}"
+        )
+        channel = self.make_request(
+            "POST",
+            redeem_url.format(token=tokens[0], key="attempt-1"),
+            access_token=f_access_token,
+        )
+        self.assertEqual(channel.code, 200, msg=channel.result)
+        rooms = channel.json_body["rooms"]
+        self.assertCountEqual(rooms[:-1], rooms_to_invite)
+
+        # the retry gets the same answer, without redeeming again
+        channel = self.make_request(
+            "POST",
+            redeem_url.format(token=tokens[0], key="attempt-1"),
+            access_token=f_access_token,
+        )
+        self.assertEqual(channel.code, 200, msg=channel.result)
+        self.assertEqual(channel.json_body["rooms"], rooms)
+
+        # without the key it is a second redeem
+        channel = self.make_request(
+            "POST",
+            "/_synapse/client/super_invites/redeem?token={token}".format(
+                token=tokens[0]
+            ),
+            access_token=f_access_token,
+        )
+        self.assertEqual(channel.code, 400, msg=channel.result)
+        self.assertEqual(channel.json_body["errcode"], "ALREADY_REDEEMED")
+
+        # and the key can't be used for another token
+        channel = self.make_request(
+            "POST",
+            redeem_url.format(token=tokens[1], key="attempt-1"),
+            access_token=f_access_token,
+        )
+        self.assertEqual(channel.code, 400, msg=channel.result)
+        self.assertEqual(channel.json_body["errcode"], "INVALID_PARAM")
+
+        # once it failed, redeeming without the key claims the token again
+        def _fail(session: Session) -> None:
+            job_id = session.scalar(
+                select(RedeemJob.id).where(RedeemJob.idempotency_key == "attempt-1")
+            )
+            assert job_id is not None
+            fail_job(session, job_id, "failed")
+
+        redeem = self.hs._module_web_resources["/_synapse/client/super_invites/redeem"]
+        redeem.db.run_blocking(_fail)
+        channel = self.make_request(
+            "POST",
+            "/_synapse/client/super_invites/redeem?token={token}".format(
+                token=tokens[0]
+            ),
+            access_token=f_access_token,
+        )
+        self.assertEqual(channel.code, 200, msg=channel.result)
+
+        # so retrying the failed one doesn't join the rooms a second time
+        for background in ("false", "true"):
+            channel = self.make_request(
+                "POST",
+                (redeem_url + "&background={background}").format(
+                    token=tokens[0], key="attempt-1", background=background
+                ),
+                access_token=f_access_token,
+            )
+            self.assertEqual(channel.code, 400, msg=channel.result)
+            self.assertEqual(channel.json_body["errcode"], "ALREADY_REDEEMED")
+
+    @override_config(DEFAULT_CONFIG)  # type: ignore[misc]
+    def test_abandoned_redeem_jobs_are_resumed(self) -> None:
+        m_id = self.register_user("meeko", "password")
+        m_access_token = self.login("meeko", "password")
+
+        rooms_to_invite = [self.create_room(m_id) for _ in range(2)]
+        channel = self.make_request(
+            "POST",
+            "/_synapse/client/super_invites/tokens",
+            access_token=m_access_token,
+            content={"rooms": rooms_to_invite, "create_dm": False},
+        )
+        self.assertEqual(channel.code, 200, msg=channel.result)
+        token = channel.json_body["token"]["token"]
+
+        jobs = {}
+        for name in ("flit", "lolo"):
+            self.register_user(name, name)
+            access_token = self.login(name, name)
+            channel = self.make_request(
+                "POST",
+                "/_synapse/client/super_invites/redeem?token={token}&background=true".format(
+                    token=token
+                ),
+                access_token=access_token,
+            )
+            self.assertEqual(channel.code, 202, msg=channel.result)
+            jobs[name] = (channel.json_body["job_id"], access_token)
+
+        # flit's runner went away long ago, lolo's is still at it
+        now = datetime.now(timezone.utc)
+        updates = {jobs["flit"][0]: now - timedelta(days=1), jobs["lolo"][0]: now}
+
+        def _set_running(session: Session) -> None:
+            for job_id, updated_at in updates.items():
+                session.execute(
+                    update(RedeemJob)
+                    .where(RedeemJob.id == job_id)
+                    .values(status="running", updated_at=updated_at)
+                )
+
+        redeem = self.hs._module_web_resources["/_synapse/client/super_invites/redeem"]
+        redeem.db.run_blocking(_set_running)
+
+        self.reactor.advance(2)
+
+        for name, status in (("flit", "done"), ("lolo", "running")):
+            job_id, access_token = jobs[name]
+            channel = self.make_request(
+                "GET",
+                "/_synapse/client/super_invites/redeem_jobs?job={job}".format(
+                    job=job_id
+                ),
+                access_token=access_token,
+            )
+            self.assertEqual(channel.code, 200, msg=channel.result)
+            self.assertEqual(channel.json_body["status"], status)
+
+    @override_config(DEFAULT_CONFIG)  # type: ignore[misc]
+    def test_info_follows_profile_changes(self) -> None:
+        m_id = self.register_user("meeko", "password")
+        m_access_token = self.login("meeko", "password")
+
+        channel = self.make_request(
+            "POST",
+            "/_synapse/client/super_invites/tokens",
+            access_token=m_access_token,
+            content={"create_dm": True},
+        )
+        self.assertEqual(channel.code, 200, msg=channel.result)
+        token = channel.json_body["token"]["token"]
+
+        _f_id = self.register_user("flit", "flit")
+        f_access_token = self.login("flit", "flit")
+
+        channel = self.make_request(
+            "GET",
+            "/_synapse/client/super_invites/info?token={token}".format(token=token),
+            access_token=f_access_token,
+        )
+        self.assertEqual(channel.code, 200, msg=channel.result)
+        self.assertEqual(channel.json_body["inviter"]["display_name"], "meeko")
+
+        channel = self.make_request(
+            "PUT",
+            "/_matrix/client/v3/profile/{user_id}/displayname".format(user_id=m_id),
+            access_token=m_access_token,
+            content={"displayname": "Meeko the Cat"},
+        )
+        self.assertEqual(channel.code, 200, msg=channel.result)
+
+        # the cached profile has been dropped
+        channel = self.make_request(
+            "GET",
+            "/_synapse/client/super_invites/info?token={token}".format(token=token),
+            access_token=f_access_token,
+        )
+        self.assertEqual(channel.code, 200, msg=channel.result)
+        self.assertEqual(channel.json_body["inviter"]["display_name"], "Meeko the Cat")
+
+    @override_config(DEFAULT_CONFIG)  # type: ignore[misc]
+    def test_info_follows_token_changes(self) -> None:
+        m_id = self.register_user("meeko", "password")
+        m_access_token = self.login("meeko", "password")
+        room_a = self.create_room(m_id)
+        room_b = self.create_room(m_id)
+
+        channel = self.make_request(
+            "POST",
+            "/_synapse/client/super_invites/tokens",
+            access_token=m_access_token,
+            content={"rooms": [room_a]},
+        )
+        self.assertEqual(channel.code, 200, msg=channel.result)
+        token = channel.json_body["token"]["token"]
+
+        _f_id = self.register_user("flit", "flit")
+        f_access_token = self.login("flit", "flit")
+
+        channel = self.make_request(
+            "GET",
+            "/_synapse/client/super_invites/info?token={token}".format(token=token),
+            access_token=f_access_token,
+        )
+        self.assertEqual(channel.code, 200, msg=channel.result)
+        self.assertEqual(channel.json_body["rooms_count"], 1)
+        self.assertEqual(channel.json_body["create_dm"], False)
+
+        # editing the token is seen right away
+        channel = self.make_request(
+            "POST",
+            "/_synapse/client/super_invites/tokens",
+            access_token=m_access_token,
+            content={"token": token, "rooms": [room_a, room_b], "create_dm": True},
+        )
+        self.assertEqual(channel.code, 200, msg=channel.result)
+
+        channel = self.make_request(
+            "GET",
+            "/_synapse/client/super_invites/info?token={token}".format(token=token),
+            access_token=f_access_token,
+        )
+        self.assertEqual(channel.code, 200, msg=channel.result)
+        self.assertEqual(channel.json_body["rooms_count"], 3)
+        self.assertEqual(channel.json_body["create_dm"], True)
+
+        # and so is deleting it
+        channel = self.make_request(
+            "DELETE",
+            "/_synapse/client/super_invites/tokens?token={token}".format(token=token),
+            access_token=m_access_token,
+        )
+        self.assertEqual(channel.code, 200, msg=channel.result)
+
+        channel = self.make_request(
+            "GET",
+            "/_synapse/client/super_invites/info?token={token}".format(token=token),
+            access_token=f_access_token,
+        )
+        self.assertEqual(channel.code, 403, msg=channel.result)
+
+        channel = self.make_request(
+            "POST",
+            "/_synapse/client/super_invites/redeem?token={token}".format(token=token),
+            access_token=f_access_token,
+        )
+        self.assertEqual(channel.code, 404, msg=channel.result)
+
+    @override_config(
+        {
+            "enable_registration": True,
+            "registration_requires_token": True,
+            "modules": [
+                {
+                    "module": "synapse_super_invites.SynapseSuperInvites",
+                    "config": {
+                        "sql_url": "sqlite:///",
+                        "generate_registration_token": True,
+                    },
+                }
+            ],
+        }
+    )  # type: ignore[misc]
+    def test_bulk_create(self) -> None:
+        m_id = self.register_user("meeko", "password")
+        m_access_token = self.login("meeko", "password")
+        room_a = self.create_room(m_id)
+        room_b = self.create_room(m_id)
+
+        # a campaign of tokens for the same rooms
+        channel = self.make_request(
+            "POST",
+            "/_synapse/client/super_invites/bulk_tokens",
+            access_token=m_access_token,
+            content={"count": 50, "rooms": [room_a, room_b], "create_dm": True},
+        )
+        self.assertEqual(channel.code, 200, msg=channel.result)
+        tokens = channel.json_body["tokens"]
+        self.assertEqual(len(set(tokens)), 50)
+        self.assertTrue(channel.json_body["registration_token"]["valid"])
+
+        channel = self.make_request(
+            "GET",
+            "/_matrix/client/v1/register/m.login.registration_token/validity?token={token}".format(
+                token=tokens[-1]
+            ),
+        )
+        self.assertEqual(channel.code, 200, msg=channel.result)
+        self.assertTrue(channel.json_body["valid"])
+
+        # or each with its own
+        channel = self.make_request(
+            "POST",
+            "/_synapse/client/super_invites/bulk_tokens",
+            access_token=m_access_token,
+            content={
+                "tokens": [
+                    {"token": "team-a", "rooms": [room_a]},
+                    {"rooms": [room_b], "create_dm": True},
+                ],
+                "as_registration_token": False,
+            },
+        )
+        self.assertEqual(channel.code, 200, msg=channel.result)
+        self.assertEqual(channel.json_body["tokens"][0], "team-a")
+
+        channel = self.make_request(
+            "GET",
+            "/_synapse/client/super_invites/tokens?limit=1000",
+            access_token=m_access_token,
+        )
+        self.assertEqual(channel.code, 200, msg=channel.result)
+        listed = {t["token"]: t for t in channel.json_body["tokens"]}
+        self.assertEqual(len(listed), 52)
+        self.assertCountEqual(listed[tokens[0]]["rooms"], [room_a, room_b])
+        self.assertTrue(listed[tokens[0]]["create_dm"])
+        self.assertEqual(listed["team-a"]["rooms"], [room_a])
+        self.assertFalse(listed["team-a"]["create_dm"])
+
+        # ids are never reused
+        channel = self.make_request(
+            "POST",
+            "/_synapse/client/super_invites/bulk_tokens",
+            access_token=m_access_token,
+            content={"tokens": [{"token": "team-a"}]},
+        )
+        self.assertEqual(channel.code, 400, msg=channel.result)
+        self.assertEqual(channel.json_body["errcode"], "TOKEN_EXISTS")
+
+        # refused before anything is built from the count
+        for count in (0, MAX_BULK_TOKENS + 1, 10**12):
+            channel = self.make_request(
+                "POST",
+                "/_synapse/client/super_invites/bulk_tokens",
+                access_token=m_access_token,
+                content={"count": count},
+            )
+            self.assertEqual(channel.code, 400, msg=channel.result)
+            self.assertEqual(channel.json_body["errcode"], "INVALID_PARAM")
+
+    @override_config(
+        {
+            "enable_registration": True,
+            "registration_requires_token": True,
+            "modules": [
+                {
+                    "module": "synapse_super_invites.SynapseSuperInvites",
+                    "config": {
+                        "sql_url": "sqlite:///",
+                        "generate_registration_token": True,
+                    },
+                }
+            ],
+        }
+    )  # type: ignore[misc]
+    def test_registration_tokens_provisioned_once(self) -> None:
+        self.register_user("meeko", "password")
+        m_access_token = self.login("meeko", "password")
+        # e.g. created by an admin already
+        self.get_success(self.store.create_registration_token("existing", None, None))
+
+        for _ in range(2):
+            channel = self.make_request(
+                "POST",
+                "/_synapse/client/super_invites/tokens",
+                {"token": "existing", "rooms": []},
+                access_token=m_access_token,
+            )
+            self.assertEqual(channel.code, 200, msg=channel.result)
+            self.assertTrue(channel.json_body["registration_token"]["valid"])
+
+        channel = self.make_request(
+            "POST",
+            "/_synapse/client/super_invites/bulk_tokens",
+            access_token=m_access_token,
+            content={"tokens": [{"token": "campaign-1"}, {"token": "campaign-2"}]},
+        )
+        self.assertEqual(channel.code, 200, msg=channel.result)
+        self.assertTrue(channel.json_body["registration_token"]["valid"])
+
+        tokens = self.get_success(self.store.get_registration_tokens())
+        self.assertCountEqual(
+            [t["token"] for t in tokens], ["existing", "campaign-1", "campaign-2"]
+        )
@@ -8,16 +8,35 @@ from tempfile import TemporaryDirectory
 from synapse.types import Dict, Any, Tuple, JsonDict, Requester
 from urllib.parse import urlencode
 
+from PIL import Image
+
+import gzip
 import hashlib
 import atexit
 import os
 
+try:
+    import boto3  # type: ignore[import-untyped]
+    from moto import mock_aws
+except ImportError:
+    mock_aws = None  # type: ignore[assignment]
+
 test_dir = TemporaryDirectory()
 target_dir = test_dir.name
 URL_PREFIX = "https://app.example.com/p/"
 
 atexit.register(test_dir.cleanup)
 
+write_behind_test_dir = TemporaryDirectory()
+write_behind_dir = write_behind_test_dir.name
+
+atexit.register(write_behind_test_dir.cleanup)
+
+lazy_test_dir = TemporaryDirectory()
+lazy_dir = lazy_test_dir.name
+
+atexit.register(lazy_test_dir.cleanup)
+
 TEST_CONFIG = {
     "modules": [
         {
@@ -514,3 +533,447 @@ class ShareLinkTests(SuperInviteHomeserverTestCase):
         self.assertEqual(channel.json_body["url"], targetUri)
 
         self.ensureTargetFiles(targetHash)
+
+    @ override_config(TEST_CONFIG)  # type: ignore[misc]
+    def test_skips_unchanged_pages(self) -> None:
+        m_id = self.register_user("meeko", "password")
+        m_access_token = self.login("meeko", "password")
+        content = {
+            "type": "roomId",
+            "roomId": "!unchanged:acter.global",
+        }
+
+        channel = self.make_request(
+            "PUT", "/_synapse/client/share_link/", access_token=m_access_token,
+            content=content,
+        )
+        self.assertEqual(channel.code, 200, msg=channel.result)
+
+        targetHash, targetUri = self.make_hash_and_uri(
+            "roomid/!unchanged:acter.global", user_id=m_id)
+        target_file = os.path.join(target_dir, '{b}.html'.format(b=targetHash))
+        with open(target_file, mode='w') as f:
+            f.write("untouched")
+
+        # sharing it again doesn't generate it again
+        channel = self.make_request(
+            "PUT", "/_synapse/client/share_link/", access_token=m_access_token,
+            content=content,
+        )
+        self.assertEqual(channel.code, 200, msg=channel.result)
+        self.assertEqual(channel.json_body["url"], targetUri)
+        with open(target_file) as f:
+            self.assertEqual(f.read(), "untouched")
+
+        # unless we ask for it
+        channel = self.make_request(
+            "PUT", "/_synapse/client/share_link/?force=true",
+            access_token=m_access_token,
+            content=content,
+        )
+        self.assertEqual(channel.code, 200, msg=channel.result)
+        with open(target_file) as f:
+            self.assertNotEqual(f.read(), "untouched")
+
+        # or the sharer changed their name
+        with open(target_file, mode='w') as f:
+            f.write("untouched")
+        channel = self.make_request(
+            "PUT",
+            "/_matrix/client/v3/profile/{user_id}/displayname".format(user_id=m_id),
+            access_token=m_access_token,
+            content={"displayname": "Meeko the Cat"},
+        )
+        self.assertEqual(channel.code, 200, msg=channel.result)
+        channel = self.make_request(
+            "PUT", "/_synapse/client/share_link/", access_token=m_access_token,
+            content=content,
+        )
+        self.assertEqual(channel.code, 200, msg=channel.result)
+        with open(target_file) as f:
+            self.assertIn("Meeko the Cat", f.read())
+
+    @ override_config({
+        "modules": [
+            {
+                "module": "synapse_super_invites.SynapseSuperInvites",
+                "config": {
+                    "sql_url": "sqlite:///",
+                    "share_link_generator": {
+                        "url_prefix": URL_PREFIX,
+                        "target_path": write_behind_dir,
+                        "write_behind_ms": 1000,
+                    }
+                },
+            }
+        ]
+    })  # type: ignore[misc]
+    def test_write_behind(self) -> None:
+        m_id = self.register_user("meeko", "password")
+        m_access_token = self.login("meeko", "password")
+
+        channel = self.make_request(
+            "PUT", "/_synapse/client/share_link/", access_token=m_access_token,
+            content={
+                "type": "roomId",
+                "roomId": "!behind:acter.global",
+            },
+        )
+        self.assertEqual(channel.code, 200, msg=channel.result)
+        targetHash, targetUri = self.make_hash_and_uri(
+            "roomid/!behind:acter.global", user_id=m_id)
+        self.assertEqual(channel.json_body["url"], targetUri)
+
+        # not there yet
+        self.assertEqual(os.listdir(write_behind_dir), [])
+
+        self.reactor.advance(1)
+
+        # written, without any temporary files left behind
+        self.assertEqual(os.listdir(write_behind_dir),
+                         ['{b}.html'.format(b=targetHash)])
+
+    @ override_config(TEST_CONFIG)  # type: ignore[misc]
+    def test_batch(self) -> None:
+        m_id = self.register_user("meeko", "password")
+        m_access_token = self.login("meeko", "password")
+
+        channel = self.make_request(
+            "PUT", "/_synapse/client/share_link/batch", access_token=m_access_token,
+            content={
+                "links": [
+                    {
+                        "type": "spaceObject",
+                        "objectId": "batchA",
+                        "objectType": "pin",
+                        "roomId": "roomId",
+                    },
+                    {
+                        "type": "unknown",
+                    },
+                    {
+                        "type": "roomAlias",
+                        "roomAlias": "batch:acter.global",
+                    },
+                ]
+            },
+        )
+        self.assertEqual(channel.code, 200, msg=channel.result)
+        links = channel.json_body["links"]
+        self.assertEqual(len(links), 3)
+
+        targetHash, targetUri = self.make_hash_and_uri(
+            "o/roomId/pin/batchA", user_id=m_id)
+        self.assertEqual(links[0]["url"], targetUri)
+        self.ensureTargetFiles(targetHash)
+
+        self.assertEqual(links[1]["errcode"], "NOT_SUPPORTED")
+
+        targetHash, targetUri = self.make_hash_and_uri(
+            "r/batch:acter.global", user_id=m_id)
+        self.assertEqual(links[2]["url"], targetUri)
+        self.ensureTargetFiles(targetHash)
+
+    @ override_config(TEST_CONFIG)  # type: ignore[misc]
+    def test_batch_needs_links(self) -> None:
+        _m_id = self.register_user("meeko", "password")
+        m_access_token = self.login("meeko", "password")
+
+        channel = self.make_request(
+            "PUT", "/_synapse/client/share_link/batch", access_token=m_access_token,
+            content={"links": []},
+        )
+        self.assertEqual(channel.code, 400, msg=channel.result)
+
+    @ override_config({
+        "modules": [
+            {
+                "module": "synapse_super_invites.SynapseSuperInvites",
+                "config": {
+                    "sql_url": "sqlite:///",
+                    "share_link_generator": {
+                        "url_prefix": URL_PREFIX,
+                        "target_path": target_dir,
+                        "template_cache_dir": os.path.join(target_dir, "templates"),
+                    }
+                },
+            }
+        ]
+    })  # type: ignore[misc]
+    def test_templates_are_precompiled(self) -> None:
+        # the main template and its parts
+        self.assertEqual(
+            len(os.listdir(os.path.join(target_dir, "templates"))), 2)
+
+    @ override_config({
+        "modules": [
+            {
+                "module": "synapse_super_invites.SynapseSuperInvites",
+                "config": {
+                    "sql_url": "sqlite:///",
+                    "share_link_generator": {
+                        "url_prefix": URL_PREFIX,
+                        "target_path": target_dir,
+                        "previews": True,
+                    }
+                },
+            }
+        ]
+    })  # type: ignore[misc]
+    def test_preview_images(self) -> None:
+        m_id = self.register_user("meeko", "password")
+        m_access_token = self.login("meeko", "password")
+
+        channel = self.make_request(
+            "PUT", "/_synapse/client/share_link/", access_token=m_access_token,
+            content={
+                "type": "spaceObject",
+                "objectId": "previewId",
+                "objectType": "pin",
+                "roomId": "roomId",
+                "query": {
+                    "title": "Our next gathering",
+                    "roomDisplayName": "Community",
+                },
+            },
+        )
+        self.assertEqual(channel.code, 200, msg=channel.result)
+        targetHash, targetUri = self.make_hash_and_uri(
+            "o/roomId/pin/previewId", user_id=m_id, query={
+                "roomDisplayName": "Community",
+                "title": "Our next gathering",
+            })
+        self.assertEqual(channel.json_body["url"], targetUri)
+
+        for suffix, size in [("", (1200, 630)), ("_square", (1200, 1200))]:
+            file_name = "{b}{s}.png".format(b=targetHash, s=suffix)
+            with Image.open(os.path.join(target_dir, file_name)) as im:
+                self.assertEqual(im.size, size)
+
+        with open(os.path.join(target_dir, "{b}.html".format(b=targetHash))) as f:
+            self.assertIn(
+                '<meta property="og:image" content="{p}{b}.png">'.format(
+                    p=URL_PREFIX, b=targetHash),
+                f.read())
+
+    @ override_config({
+        "modules": [
+            {
+                "module": "synapse_super_invites.SynapseSuperInvites",
+                "config": {
+                    "sql_url": "sqlite:///",
+                    "share_link_generator": {
+                        "url_prefix": URL_PREFIX,
+                        "target_path": target_dir,
+                        "serve": True,
+                    }
+                },
+            }
+        ]
+    })  # type: ignore[misc]
+    def test_serving(self) -> None:
+        m_id = self.register_user("meeko", "password")
+        m_access_token = self.login("meeko", "password")
+
+        channel = self.make_request(
+            "PUT", "/_synapse/client/share_link/", access_token=m_access_token,
+            content={
+                "type": "roomId",
+                "roomId": "!served:acter.global",
+            },
+        )
+        self.assertEqual(channel.code, 200, msg=channel.result)
+        targetHash, _targetUri = self.make_hash_and_uri(
+            "roomid/!served:acter.global", user_id=m_id)
+        with open(os.path.join(target_dir, "{b}.html".format(b=targetHash)), 'rb') as f:
+            page = f.read()
+
+        # no login needed
+        channel = self.make_request(
+            "GET", "/_synapse/client/share_link/{b}".format(b=targetHash))
+        self.assertEqual(channel.code, 200, msg=channel.result)
+        self.assertEqual(channel.result["body"], page)
+        self.assertEqual(channel.headers.getRawHeaders("Content-Type"),
+                         ["text/html; charset=utf-8"])
+        self.assertEqual(channel.headers.getRawHeaders("Cache-Control"),
+                         ["public, max-age=3600"])
+        etag = channel.headers.getRawHeaders("ETag")[0]
+
+        # which we can revalidate
+        channel = self.make_request(
+            "GET", "/_synapse/client/share_link/{b}".format(b=targetHash),
+            custom_headers=[("If-None-Match", etag)])
+        self.assertEqual(channel.code, 304, msg=channel.result)
+        self.assertNotIn("body", channel.result)
+
+        # or get compressed
+        channel = self.make_request(
+            "GET", "/_synapse/client/share_link/{b}.html".format(b=targetHash),
+            custom_headers=[("Accept-Encoding", "gzip, br;q=0")])
+        self.assertEqual(channel.code, 200, msg=channel.result)
+        self.assertEqual(channel.headers.getRawHeaders("Content-Encoding"), ["gzip"])
+        self.assertEqual(gzip.decompress(channel.result["body"]), page)
+        self.assertNotEqual(channel.headers.getRawHeaders("ETag")[0], etag)
+
+        for path in ["0" * 40, "batch", "..%2Fsecret", "{b}.html.gz".format(b=targetHash)]:
+            channel = self.make_request(
+                "GET", "/_synapse/client/share_link/{p}".format(p=path))
+            self.assertEqual(channel.code, 404, msg=channel.result)
+
+    @ override_config({
+        "modules": [
+            {
+                "module": "synapse_super_invites.SynapseSuperInvites",
+                "config": {
+                    "sql_url": "sqlite:///",
+                    "share_link_generator": {
+                        "url_prefix": URL_PREFIX,
+                        "target_path": lazy_dir,
+                        "serve": True,
+                        "lazy": True,
+                    }
+                },
+            }
+        ]
+    })  # type: ignore[misc]
+    def test_lazy_serving(self) -> None:
+        m_id = self.register_user("meeko", "password")
+        m_access_token = self.login("meeko", "password")
+
+        channel = self.make_request(
+            "PUT", "/_synapse/client/share_link/", access_token=m_access_token,
+            content={
+                "type": "roomId",
+                "roomId": "!lazy:acter.global",
+            },
+        )
+        self.assertEqual(channel.code, 200, msg=channel.result)
+        targetHash, _targetUri = self.make_hash_and_uri(
+            "roomid/!lazy:acter.global", user_id=m_id)
+        # only the link is kept, nothing has been rendered yet
+        self.assertEqual(os.listdir(lazy_dir), ["{b}.json".format(b=targetHash)])
+
+        channel = self.make_request(
+            "GET", "/_synapse/client/share_link/{b}".format(b=targetHash))
+        self.assertEqual(channel.code, 200, msg=channel.result)
+        self.assertIn("lazy:acter.global", channel.result["body"].decode())
+        etag = channel.headers.getRawHeaders("ETag")[0]
+
+        channel = self.make_request(
+            "GET", "/_synapse/client/share_link/{b}".format(b=targetHash),
+            custom_headers=[("If-None-Match", etag)])
+        self.assertEqual(channel.code, 304, msg=channel.result)
+
+        channel = self.make_request(
+            "GET", "/_synapse/client/share_link/{b}".format(b=targetHash),
+            custom_headers=[("Accept-Encoding", "gzip")])
+        self.assertEqual(channel.code, 200, msg=channel.result)
+        self.assertEqual(channel.headers.getRawHeaders("Content-Encoding"), ["gzip"])
+        self.assertIn("lazy:acter.global", gzip.decompress(channel.result["body"]).decode())
+
+        channel = self.make_request(
+            "GET", "/_synapse/client/share_link/{b}".format(b="0" * 40))
+        self.assertEqual(channel.code, 404, msg=channel.result)
+
+    @ override_config({
+        "modules": [
+            {
+                "module": "synapse_super_invites.SynapseSuperInvites",
+                "config": {
+                    "sql_url": "sqlite:///",
+                    "share_link_generator": {
+                        "url_prefix": URL_PREFIX,
+                        "storage": "sql",
+                        "serve": True,
+                    }
+                },
+            }
+        ]
+    })  # type: ignore[misc]
+    def test_sql_storage(self) -> None:
+        m_id = self.register_user("meeko", "password")
+        m_access_token = self.login("meeko", "password")
+
+        channel = self.make_request(
+            "PUT", "/_synapse/client/share_link/", access_token=m_access_token,
+            content={
+                "type": "roomId",
+                "roomId": "!stored:acter.global",
+            },
+        )
+        self.assertEqual(channel.code, 200, msg=channel.result)
+        targetHash, _targetUri = self.make_hash_and_uri(
+            "roomid/!stored:acter.global", user_id=m_id)
+
+        channel = self.make_request(
+            "GET", "/_synapse/client/share_link/{b}".format(b=targetHash))
+        self.assertEqual(channel.code, 200, msg=channel.result)
+        self.assertIn("stored:acter.global", channel.result["body"].decode())
+        etag = channel.headers.getRawHeaders("ETag")[0]
+
+        channel = self.make_request(
+            "GET", "/_synapse/client/share_link/{b}".format(b=targetHash),
+            custom_headers=[("If-None-Match", etag)])
+        self.assertEqual(channel.code, 304, msg=channel.result)
+
+
+S3_CONFIG = {
+    "modules": [
+        {
+            "module": "synapse_super_invites.SynapseSuperInvites",
+            "config": {
+                "sql_url": "sqlite:///",
+                "share_link_generator": {
+                    "url_prefix": URL_PREFIX,
+                    "storage": "s3",
+                    "s3_bucket": "share-links",
+                    "s3_prefix": "p/",
+                    "s3_region": "us-east-1",
+                    "s3_access_key_id": "testing",
+                    "s3_secret_access_key": "testing",
+                    "serve": True,
+                }
+            },
+        }
+    ]
+}
+
+
+class S3ShareLinkTests(SuperInviteHomeserverTestCase):
+    if mock_aws is None:
+        skip = "boto3 or moto is not installed"
+
+    def setUp(self) -> None:
+        # in place before the module creates its client
+        mock = mock_aws()
+        mock.start()
+        self.addCleanup(mock.stop)
+        self.s3 = boto3.client("s3", region_name="us-east-1")
+        self.s3.create_bucket(Bucket="share-links")
+        super().setUp()
+
+    @ override_config(S3_CONFIG)  # type: ignore[misc]
+    def test_s3_storage(self) -> None:
+        self.register_user("meeko", "password")
+        m_access_token = self.login("meeko", "password")
+
+        channel = self.make_request(
+            "PUT", "/_synapse/client/share_link/", access_token=m_access_token,
+            content={
+                "type": "roomId",
+                "roomId": "!bucket:acter.global",
+            },
+        )
+        self.assertEqual(channel.code, 200, msg=channel.result)
+        targetHash = channel.json_body["url"][len(URL_PREFIX):].split("?")[0]
+
+        obj = self.s3.get_object(
+            Bucket="share-links", Key="p/{b}.html".format(b=targetHash))
+        self.assertEqual(obj["ContentType"], "text/html")
+        page = obj["Body"].read()
+
+        channel = self.make_request(
+            "GET", "/_synapse/client/share_link/{b}".format(b=targetHash))
+        self.assertEqual(channel.code, 200, msg=channel.result)
+        self.assertEqual(channel.result["body"], page)
+        self.assertEqual(channel.headers.getRawHeaders("ETag")[0], obj["ETag"])
@@ -0,0 +1,94 @@
+import os
+import time
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from synapse_super_invites.storage import FileStorage
+
+OLD = "a" * 40
+NEW = "b" * 40
+
+
+class FileStorageTests(TestCase):
+    def setUp(self) -> None:
+        self.tmp_dir = TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.path = self.tmp_dir.name
+
+    def _age(self, name: str, seconds: float) -> None:
+        then = time.time() - seconds
+        os.utime(os.path.join(self.path, name), (then, then))
+
+    def test_sharding(self) -> None:
+        storage = FileStorage(self.path, shard_depth=2)
+        storage.write({NEW + ".html": b"new"})
+        self.assertTrue(
+            os.path.exists(os.path.join(self.path, "bb", "bb", NEW + ".html"))
+        )
+        stored = storage.read(NEW + ".html")
+        assert stored is not None
+        self.assertEqual(stored.data, b"new")
+
+        # written before sharding was turned on
+        with open(os.path.join(self.path, OLD + ".html"), "wb") as f:
+            f.write(b"old")
+        self.assertIsNotNone(storage.version(OLD + ".html"))
+
+    def test_sweep_by_age(self) -> None:
+        storage = FileStorage(self.path)
+        storage.write(
+            {
+                OLD + "_square.png": b"image",
+                OLD + ".html.gz": b"compressed",
+                OLD + ".html": b"old",
+                NEW + ".html": b"new",
+                "unrelated.txt": b"not ours",
+                ".{b}.html.tmp".format(b=NEW): b"unfinished",
+            }
+        )
+        for name in os.listdir(self.path):
+            if name.startswith((OLD, ".")):
+                self._age(name, 2 * 24 * 60 * 60)
+
+        self.assertEqual(storage.sweep(24 * 60 * 60, None), 4)
+        self.assertEqual(
+            sorted(os.listdir(self.path)), [NEW + ".html", "unrelated.txt"]
+        )
+
+    def test_sweep_by_size(self) -> None:
+        storage = FileStorage(self.path, shard_depth=1)
+        storage.write({OLD + ".html": b"x" * 100, NEW + ".html": b"x" * 100})
+        self._age(os.path.join("aa", OLD + ".html"), 60)
+
+        self.assertEqual(storage.sweep(None, 150), 1)
+        self.assertIsNone(storage.version(OLD + ".html"))
+        self.assertIsNotNone(storage.version(NEW + ".html"))
+
+    def test_file_mode(self) -> None:
+        umask = os.umask(0)
+        os.umask(umask)
+        storage = FileStorage(self.path)
+        storage.write({OLD + ".html": b"old"})
+        storage.write({NEW + ".html": b"new", NEW + ".html.gz": b"compressed"})
+        for name in os.listdir(self.path):
+            mode = os.stat(os.path.join(self.path, name)).st_mode & 0o777
+            # readable by e.g. a web server, like files `open` creates
+            self.assertEqual(mode, 0o666 & ~umask, name)
+
+        # replacing a file keeps its mode
+        os.chmod(os.path.join(self.path, OLD + ".html"), 0o640)
+        storage.write({OLD + ".html": b"changed"})
+        mode = os.stat(os.path.join(self.path, OLD + ".html")).st_mode & 0o777
+        self.assertEqual(mode, 0o640)
+
+    def test_touch(self) -> None:
+        storage = FileStorage(self.path)
+        storage.write({OLD + ".html": b"old", OLD + ".html.gz": b"compressed"})
+        for name in os.listdir(self.path):
+            self._age(name, 2 * 24 * 60 * 60)
+        version = storage.version(OLD + ".html")
+
+        # e.g. served or shared again without changes
+        storage.touch(OLD + ".html")
+        self.assertEqual(storage.sweep(24 * 60 * 60, None), 0)
+        self.assertEqual(storage.version(OLD + ".html"), version)